@@ -0,0 +1,93 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-row predictions into one vectorized call
+
+    Rows submitted from request threads are queued until either `max_rows` rows
+    are waiting or `max_wait_ms` milliseconds have passed since the first one
+    arrived. Then `predict_fn(model, rows)` is called once for all of them and
+    every caller gets back its own result (or the exception of the batch).
+    """
+
+    def __init__(self, model, predict_fn, max_wait_ms=2, max_rows=64):
+        self.model = model
+        self.predict_fn = predict_fn
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_rows = max_rows
+        self.pid = os.getpid()
+        self._rows = []
+        self._futures = []
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def predict(self, row):
+        future = Future()
+        with self._cond:
+            self._rows.append(row)
+            self._futures.append(future)
+            self._cond.notify()
+        return future.result()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._rows and not self._stopped:
+                self._cond.wait()
+            deadline = time.monotonic() + self.max_wait
+            while len(self._rows) < self.max_rows and not self._stopped:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            rows, futures = self._rows[:self.max_rows], self._futures[:self.max_rows]
+            del self._rows[:self.max_rows]
+            del self._futures[:self.max_rows]
+            return rows, futures
+
+    def _run(self):
+        while True:
+            rows, futures = self._next_batch()
+            if rows:
+                try:
+                    results = self.predict_fn(self.model, rows)
+                except Exception as e:
+                    for future in futures:
+                        future.set_exception(e)
+                else:
+                    for future, result in zip(futures, results):
+                        future.set_result(result)
+            if self._stopped and not self._rows:
+                return
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher(model, predict_fn, max_wait_ms=2, max_rows=64):
+    """Return this worker process's batcher for `model`, (re)creating it as needed
+
+    A new batcher is started after forking (threads do not survive a fork)
+    and whenever a different model object is passed in (e.g. after a reload).
+    """
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None or _batcher.model is not model or _batcher.pid != os.getpid():
+            if _batcher is not None and _batcher.pid == os.getpid():
+                _batcher.stop()
+            logger.info("Starting micro-batcher (max_wait_ms=%s, max_rows=%s)", max_wait_ms, max_rows)
+            _batcher = MicroBatcher(model, predict_fn, max_wait_ms=max_wait_ms, max_rows=max_rows)
+        return _batcher
@@ -0,0 +1,123 @@
+"""Score a large CSV or JSONL file offline, in chunks and in parallel
+
+Usage:
+  python -m app.bulk_score [-c config_deploy.yml] [-n chunksize] [-w workers] input.csv|input.jsonl -o output.csv|output.jsonl
+  python -m app.bulk_score [-c config_deploy.yml] input.jsonl -s <data_sink_name>
+
+The input needs a column per feature (e.g. the query parameters of requests, one JSON object
+per line), and may contain others (like IDs), which are passed through. Chunks are predicted
+vectorized in a pool of processes, at most two per process in flight, and written in input order
+as soon as they are done. So memory use depends on the chunk size, not on the file size.
+With -s, each chunk is written using the data sink's put_dataframe (so use a sink that appends,
+such as a database table).
+"""
+import argparse
+import logging
+import os
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import mllaunchpad
+import pandas as pd
+from mllaunchpad.resource import ModelStore, create_data_sources_and_sinks
+
+from app.features import schema_for
+from app.model import FEATURES
+
+logger = logging.getLogger(__name__)
+
+# The model of a pool process, loaded once by load_model (or the exception raised loading it)
+_model = None
+_load_error = None
+
+
+def load_model(model_store_location, model_conf):
+    global _model, _load_error
+    try:
+        wrapper, _ = ModelStore(model_store_location).load_trained_model(model_conf)
+        _model = wrapper.contents
+    except Exception as e:
+        # Raised by predict_chunk, as a pool just keeps replacing processes whose initializer fails
+        _load_error = e
+
+
+def read_chunks(path, chunksize):
+    if path.endswith((".jsonl", ".json")):
+        return pd.read_json(path, lines=True, chunksize=chunksize, dtype=False)
+    return pd.read_csv(path, chunksize=chunksize)
+
+
+def predict_chunk(chunk):
+    if _load_error is not None:
+        raise _load_error
+    schema = schema_for(_model, FEATURES)
+    X = schema.matrix({name: chunk[name].tolist() for name in schema.names})
+    return _model.predict(X)
+
+
+class FileWriter:
+    def __init__(self, path):
+        self.path = path
+        self.jsonl = path.endswith((".jsonl", ".json"))
+        self.first = True
+
+    def write(self, df):
+        if self.jsonl:
+            lines = df.to_json(orient="records", lines=True)
+            with open(self.path, "w" if self.first else "a") as f:
+                f.write(lines if lines.endswith("\n") else lines + "\n")
+        else:
+            df.to_csv(self.path, mode="w" if self.first else "a", header=self.first, index=False)
+        self.first = False
+
+
+def bulk_score(input_path, write, config, chunksize=10000, workers=None):
+    """Predict all rows of `input_path`, calling `write(df)` with each chunk and its predictions in input order
+
+    Each pool process loads the model of `config` from the model store when it starts.
+    """
+    workers = workers or os.cpu_count()
+    start, rows = time.monotonic(), 0
+    in_flight = deque()
+
+    def write_oldest():
+        chunk, result = in_flight.popleft()
+        write(chunk.assign(iris_variety=result.get()))
+        return len(chunk)
+
+    with Pool(workers, initializer=load_model, initargs=(config["model_store"]["location"], config["model"])) as pool:
+        for chunk in read_chunks(input_path, chunksize):
+            in_flight.append((chunk, pool.apply_async(predict_chunk, (chunk,))))
+            while len(in_flight) >= 2 * workers or (in_flight and in_flight[0][1].ready()):
+                rows += write_oldest()
+        while in_flight:
+            rows += write_oldest()
+    elapsed = time.monotonic() - start
+    logger.info("Scored %d rows in %.1f s (%.0f rows/s) using %d processes", rows, elapsed, rows / elapsed, workers)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a large CSV or JSONL file offline.")
+    parser.add_argument("input", help="CSV or JSONL (.jsonl) file with a column per feature")
+    parser.add_argument("-c", "--config", help="Config file (default: LAUNCHPAD_CFG or ./LAUNCHPAD_CFG.yml)")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument("-o", "--output", help="CSV or JSONL (.jsonl) file to write the input plus predictions to")
+    output.add_argument("-s", "--sink", help="Name of a data sink in the config to write the results to")
+    parser.add_argument("-n", "--chunksize", type=int, default=10000, help="Rows per chunk, default 10000")
+    parser.add_argument("-w", "--workers", type=int, help="Number of processes, default: number of cores")
+    args = parser.parse_args()
+
+    config = mllaunchpad.get_validated_config(args.config) if args.config else mllaunchpad.get_validated_config()
+    if args.sink:
+        _, data_sinks = create_data_sources_and_sinks(config)
+        write = data_sinks[args.sink].put_dataframe
+    else:
+        write = FileWriter(args.output).write
+    bulk_score(args.input, write, config, chunksize=args.chunksize, workers=args.workers)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    main()
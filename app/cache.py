@@ -0,0 +1,94 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionCache:
+    """Bounded LRU cache with time-to-live for single-row prediction results
+
+    Keys are the feature values of a request, coerced by the model's feature
+    schema and rounded to `decimals` digits, so e.g. "4.9" and 4.90 share an
+    entry. A `ttl` of 0 means entries never expire. The cache belongs to one
+    model object and is dropped as soon as predictions use another one.
+    """
+
+    def __init__(self, model, version, capacity=1024, ttl=0, decimals=6, log_every=0):
+        self.model = model
+        self.version = version
+        self.capacity = capacity
+        self.ttl = ttl
+        self.decimals = decimals
+        self.log_every = log_every
+        self.pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, schema, args):
+        return tuple(round(schema.coerce(name, args.get(name)), self.decimals) for name in schema.names)
+
+    def get(self, key):
+        """Return (True, value) for a fresh entry, else (False, None)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.monotonic() - entry[1] > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            lookups = self.hits + self.misses
+        if self.log_every and lookups % self.log_every == 0:
+            logger.info("Prediction cache stats: %s", self.stats())
+        return (False, None) if entry is None else (True, entry[0])
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "version": self.version,
+                "size": len(self._entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(model, version, capacity=1024, ttl=0, decimals=6, log_every=0):
+    """Return this worker process's cache for `model`, starting an empty one for a new model or version"""
+    global _cache
+    with _cache_lock:
+        if _cache is None or _cache.model is not model or _cache.version != version or _cache.pid != os.getpid():
+            if _cache is not None:
+                logger.info("Starting new prediction cache for model version %s (previous: %s)",
+                            version, _cache.stats())
+            _cache = PredictionCache(model, version, capacity=capacity, ttl=ttl, decimals=decimals,
+                                     log_every=log_every)
+        return _cache
+
+
+def cache_stats():
+    """Hit/miss counters of this worker's prediction cache (None if no cache is in use)"""
+    return None if _cache is None else _cache.stats()
@@ -0,0 +1,178 @@
+"""Additional datasource types. To use them, add this module to the config's plugins:
+
+plugins:
+  - app.datasources
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from mllaunchpad.resource import DataSource
+
+logger = logging.getLogger(__name__)
+
+columns_file_name = "columns.json"
+
+
+class CachingDataSource(DataSource):
+    """Base class for datasources that cache what `load()` returns according to `cache_expires`
+
+    These datasources do their own caching, so mllaunchpad's caching of what `get_*`
+    methods return has to be switched off using `expires: 0` (anything else is
+    rejected). This also allows reading them in chunks.
+
+    cache_expires: -1: cache forever, 0: no caching, >0: number of seconds to cache.
+
+    With `refresh_ahead: <seconds>` (and cache_expires > 0), the data is reloaded in
+    a background thread that many seconds before it expires and then swapped in
+    atomically (stale-while-revalidate). Requests keep being served from the
+    previous copy in the meantime and never pay for the reload themselves.
+    Only if background reloading keeps failing for another `cache_expires` seconds
+    is the data reloaded inline again.
+
+    Subclasses have to list DataSource as a base class as well, because mllaunchpad
+    only looks for plugin datasource types among its direct subclasses.
+    """
+
+    def __init__(self, identifier, datasource_config, sub_config=None):
+        super().__init__(identifier, datasource_config)
+        self.identifier = identifier
+        self.path = datasource_config["path"]
+        self.cache_expires = datasource_config.get("cache_expires", 0)
+        self.refresh_ahead = datasource_config.get("refresh_ahead", 0)
+        self.options = datasource_config.get("options") or {}
+        if self.expires != 0:
+            raise ValueError("Datasource {}: expires must be 0, as this type caches by itself "
+                             "(use cache_expires: {} instead)".format(identifier, self.expires))
+        if self.refresh_ahead and not 0 < self.refresh_ahead < self.cache_expires:
+            raise ValueError("Datasource {}: refresh_ahead ({}) must be between 0 and cache_expires ({})".format(
+                identifier, self.refresh_ahead, self.cache_expires))
+        self._cached = None
+        self._loaded_at = None
+        self._lock = threading.Lock()
+        self._refresher_pid = None
+
+    def load(self):
+        raise NotImplementedError()
+
+    def is_fresh(self, max_age=None):
+        if self._loaded_at is None or self.cache_expires == 0:
+            return False
+        return self.cache_expires < 0 or time.monotonic() - self._loaded_at < (max_age or self.cache_expires)
+
+    def _cached_data(self):
+        # Not named get_*, which mllaunchpad's DataSource metaclass would wrap into its own caching
+        with self._lock:
+            background = self.refresh_ahead and self._loaded_at is not None
+            if not self.is_fresh(2 * self.cache_expires if background else None):
+                self._cached, self._loaded_at = self._timed_load(), time.monotonic()
+            if self.refresh_ahead:
+                self._ensure_refresher()
+            return self._cached
+
+    def _timed_load(self):
+        start = time.monotonic()
+        data = self.load()
+        logger.debug("Loaded datasource %s in %.1f ms", self.identifier, (time.monotonic() - start) * 1000)
+        return data
+
+    def _ensure_refresher(self):
+        # Threads don't survive forking, so e.g. with gunicorn --preload each worker starts its own
+        if self._refresher_pid != os.getpid():
+            self._refresher_pid = os.getpid()
+            thread = threading.Thread(target=self._refresh_loop, name="refresh-{}".format(self.identifier),
+                                      daemon=True)
+            thread.start()
+
+    def _refresh_loop(self):
+        while True:
+            wait = self._loaded_at + self.cache_expires - self.refresh_ahead - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                data = self._timed_load()
+            except Exception:
+                logger.exception("Background refresh of datasource %s failed, retrying", self.identifier)
+                time.sleep(min(self.refresh_ahead, 10))
+                continue
+            with self._lock:
+                self._cached, self._loaded_at = data, time.monotonic()
+
+
+class NpyDataSource(CachingDataSource, DataSource):
+    """Columnar binary datasource: a directory with one NumPy .npy file per column
+
+    Create it from a CSV file using `python build.py --convert <config_file>`.
+    The column files are memory-mapped, so loading parses nothing and takes
+    milliseconds, and the OS shares the pages between all workers. `get_raw()`
+    returns the memory-mapped columns themselves (zero-copy), `get_dataframe()`
+    wraps them in a DataFrame without copying them (with pandas 2 or later, older
+    versions copy them into one block). Supports background refresh (see CachingDataSource).
+
+    Config example:
+      petals:
+        type: npy
+        path: ./private/iris_train_npy  # the directory written by build.py --convert
+        expires: 0  # required, see cache_expires
+        cache_expires: 3600
+    """
+
+    serves = ["npy"]
+
+    def load(self):
+        with open(os.path.join(self.path, columns_file_name)) as f:
+            meta = json.load(f)
+        return OrderedDict(
+            (column["name"], np.load(os.path.join(self.path, column["file"]), mmap_mode="r"))
+            for column in meta["columns"]
+        )
+
+    def get_raw(self, params=None, chunksize=None):
+        return self._cached_data()
+
+    def get_dataframe(self, params=None, chunksize=None):
+        columns = self._cached_data()
+        if chunksize:
+            return self._chunks(columns, chunksize)
+        return pd.DataFrame(columns, copy=False)
+
+    @staticmethod
+    def _chunks(columns, chunksize):
+        n_rows = len(next(iter(columns.values()))) if columns else 0
+        for start in range(0, n_rows, chunksize):
+            yield pd.DataFrame(OrderedDict((name, c[start:start + chunksize]) for name, c in columns.items()),
+                               copy=False)
+
+
+class RefreshingCsvDataSource(CachingDataSource, DataSource):
+    """CSV file datasource supporting background refresh (see CachingDataSource)
+
+    Config example:
+      petals_test:
+        type: refreshing_csv
+        path: ./private/iris_holdout.csv
+        expires: 0  # required, see cache_expires
+        cache_expires: 3600
+        refresh_ahead: 60  # reload in the background one minute before expiry
+        options: {}  # passed to pandas.read_csv
+    """
+
+    serves = ["refreshing_csv"]
+
+    def load(self):
+        return pd.read_csv(self.path, **self.options)
+
+    def get_raw(self, params=None, chunksize=None):
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def get_dataframe(self, params=None, chunksize=None):
+        if chunksize:
+            return pd.read_csv(self.path, chunksize=chunksize, **self.options)
+        return self._cached_data()
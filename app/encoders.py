@@ -0,0 +1,79 @@
+"""Response encodings for batch predictions, chosen by the request's Accept header
+
+- application/json (default): the usual {"predictions": [...]} object, encoded with orjson if installed
+- application/msgpack: the same object as MessagePack (needs msgpack)
+- application/vnd.apache.arrow.stream: one column per output in Arrow IPC stream format (needs pyarrow)
+
+The optional packages are only used if they are installed (add them to requirements.txt),
+and an encoding whose package is missing is never chosen.
+"""
+import flask
+from werkzeug.exceptions import BadRequest
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ARROW = "application/vnd.apache.arrow.stream"
+
+SUPPORTED = [JSON] + ([MSGPACK] if msgpack else []) + ([ARROW] if pa else [])
+
+
+def posted():
+    """Whether the current request is a POST, which is always answered in the batch format"""
+    return flask.has_request_context() and flask.request.method == "POST"
+
+
+def reject_non_object_bodies(app):
+    """Answer POST requests to the Flask `app` whose JSON body is not an object with 400 (Bad Request)
+
+    mllaunchpad's request parser fails with an internal server error on other
+    bodies, such as a list of row objects. run.sh's gunicorn_conf.py calls this.
+    """
+    @app.before_request
+    def check_body():
+        if flask.request.method == "POST" and flask.request.is_json:
+            if not isinstance(flask.request.get_json(silent=True), dict):
+                raise BadRequest("The body must be a JSON object with a list of values per feature")
+
+
+def negotiate():
+    """Best supported mimetype for the current request's Accept header (JSON outside of requests)"""
+    if not flask.has_request_context():
+        return JSON
+    return flask.request.accept_mimetypes.best_match(SUPPORTED, default=JSON)
+
+
+def encode_predictions(name, values):
+    """Batch prediction result for an array of predicted `values` of the output `name`
+
+    Returns a Flask response for binary encodings and orjson, else the plain
+    dict for the API to serialize as usual. Outside of requests (e.g. when
+    calling the model from Python), always returns the plain dict.
+    """
+    mimetype = negotiate()
+    if mimetype == ARROW:
+        sink = pa.BufferOutputStream()
+        table = pa.table({name: values})
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return flask.Response(sink.getvalue().to_pybytes(), mimetype=ARROW)
+    payload = {"predictions": [{name: v} for v in values.tolist()]}
+    if not flask.has_request_context():
+        return payload
+    if mimetype == MSGPACK:
+        return flask.Response(msgpack.packb(payload, use_bin_type=True), mimetype=MSGPACK)
+    if orjson is not None:
+        return flask.Response(orjson.dumps(payload), mimetype=JSON)
+    return payload
@@ -0,0 +1,117 @@
+import math
+import threading
+import weakref
+
+import numpy as np
+
+
+class InvalidFeatures(ValueError):
+    """Args that can't be turned into feature rows (the caller's fault, e.g. HTTP 400 in the API)"""
+
+
+class FeatureSchema:
+    """Maps prediction args to float64 NumPy rows in a fixed feature order
+
+    The schema is compiled once per model, so the hot path only looks up the
+    known feature names, coerces each value to float and writes it into a
+    preallocated row, without any pandas DataFrame construction or dtype
+    inference. Invalid input raises InvalidFeatures naming the offending feature.
+    """
+
+    def __init__(self, names):
+        self.names = tuple(names)
+        self._local = threading.local()
+
+    def __len__(self):
+        return len(self.names)
+
+    def is_batch(self, args):
+        """Whether args hold several rows (columnar dict of lists or list of row dicts)"""
+        if isinstance(args, dict):
+            return any(isinstance(args.get(name), (list, tuple)) for name in self.names)
+        return isinstance(args, (list, tuple))
+
+    def unwrap(self, args):
+        """Turn args with at most one value per feature (in a list or not) into single-row args
+
+        The API parses repeatable query parameters into lists, so that a single row
+        arrives as lists of one value each. Args with more values are returned as they are.
+        """
+        if not isinstance(args, dict):
+            return args
+        values = [args.get(name) for name in self.names]
+        if any(isinstance(v, (list, tuple)) and len(v) != 1 for v in values):
+            return args
+        row = dict(args)
+        row.update((name, v[0]) for name, v in zip(self.names, values) if isinstance(v, (list, tuple)))
+        return row
+
+    def coerce(self, name, value):
+        if value is None:
+            raise InvalidFeatures("Missing feature '{}'".format(name))
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            raise InvalidFeatures("Feature '{}' must be a number, got {!r}".format(name, value))
+        if not math.isfinite(number):
+            raise InvalidFeatures("Feature '{}' must be finite, got {!r}".format(name, value))
+        return number
+
+    def row(self, args):
+        """Fill and return this thread's preallocated 1 x n row from a single-row args dict
+
+        The returned array is reused by the next call from the same thread.
+        """
+        buf = getattr(self._local, "row", None)
+        if buf is None:
+            buf = self._local.row = np.empty((1, len(self.names)), dtype=np.float64)
+        for i, name in enumerate(self.names):
+            buf[0, i] = self.coerce(name, args.get(name))
+        return buf
+
+    def matrix(self, args):
+        """Build a new rows x n matrix from a single row, a columnar dict of lists or a list of row dicts"""
+        if isinstance(args, dict):
+            if not self.is_batch(args):
+                return self.row(args).copy()
+            columns = [args.get(name) for name in self.names]
+            lengths = {len(c) if isinstance(c, (list, tuple)) else None for c in columns}
+            if len(lengths) != 1 or None in lengths:
+                raise InvalidFeatures("Batch columns {} must all be lists of the same length".format(list(self.names)))
+            X = np.empty((lengths.pop(), len(self.names)), dtype=np.float64)
+            for j, (name, column) in enumerate(zip(self.names, columns)):
+                X[:, j] = self._column(name, column)
+            return X
+        X = np.empty((len(args), len(self.names)), dtype=np.float64)
+        for j, name in enumerate(self.names):
+            X[:, j] = self._column(name, [row.get(name) for row in args])
+        return X
+
+    def _column(self, name, values):
+        try:
+            column = np.asarray(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            column = None
+        if column is None or column.ndim != 1 or not np.isfinite(column).all():
+            # Slow path, only to find and report the offending value
+            column = np.array([self.coerce(name, v) for v in values], dtype=np.float64)
+        return column
+
+
+_schemas = weakref.WeakKeyDictionary()
+_schemas_lock = threading.Lock()
+
+
+def schema_for(model, default_names):
+    """Return the compiled schema of `model`, compiling it on first use
+
+    Feature names are taken from the columns the model has been trained on
+    (`feature_order`, or `feature_names_in_` for models trained on DataFrames)
+    and fall back to `default_names` for older models.
+    """
+    with _schemas_lock:
+        schema = _schemas.get(model)
+        if schema is None:
+            names = getattr(model, "feature_order", getattr(model, "feature_names_in_", None))
+            schema = _schemas[model] = FeatureSchema(default_names if names is None else list(names))
+        return schema
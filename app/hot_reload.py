@@ -0,0 +1,97 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import mllaunchpad
+from mllaunchpad.resource import ModelStore
+
+logger = logging.getLogger(__name__)
+
+test_url_file_name = "LAUNCHPAD_TEST_URL.txt"
+
+
+def test_query_args(test_url_file=test_url_file_name):
+    """Args dict of the deployed test query (from LAUNCHPAD_TEST_URL.txt), None if there is none"""
+    if not os.path.exists(test_url_file):
+        return None
+    with open(test_url_file) as f:
+        return dict(parse_qsl(urlsplit(f.read().strip()).query))
+
+
+class ModelWatcher:
+    """Hot-swaps a retrained model into a running worker
+
+    A background thread polls the model's file in the model store. Once it has
+    changed and stayed unchanged for one poll interval (i.e. is completely
+    written), the new model is loaded, warmed up by calling `warm_fn(model, args)`
+    with the args of the deployed test query, and only then swapped in with a
+    single assignment. Requests keep using the previous model until then, and
+    a model that fails to load or warm up is never swapped in.
+    """
+
+    def __init__(self, model, config, warm_fn, poll_seconds=10):
+        self.model = model
+        self.initial_model = model
+        self.config = config
+        self.warm_fn = warm_fn
+        self.poll_seconds = poll_seconds
+        self.pid = os.getpid()
+        self.model_file = os.path.join(
+            config["model_store"]["location"],
+            "{}_{}.pkl".format(config["model"]["name"], config["model"]["version"]))
+        self._thread = threading.Thread(target=self._run, name="model-watcher", daemon=True)
+        self._thread.start()
+
+    def _file_state(self):
+        try:
+            stat = os.stat(self.model_file)
+            return stat.st_mtime, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _run(self):
+        loaded_state = self._file_state()
+        seen_state = loaded_state
+        while True:
+            time.sleep(self.poll_seconds)
+            state = self._file_state()
+            if state is None or state == loaded_state:
+                continue
+            if state != seen_state:
+                seen_state = state  # still being written? check again next time
+                continue
+            loaded_state = state
+            try:
+                self.reload()
+            except Exception:
+                logger.exception("Could not hot-reload model from %s, keeping the current model", self.model_file)
+
+    def reload(self):
+        start = time.monotonic()
+        # The model store holds the model wrapped into its ModelInterface, the model itself is its contents
+        wrapper, _ = ModelStore(self.config).load_trained_model(self.config["model"])
+        new_model = wrapper.contents
+        args = test_query_args()
+        if args is not None:
+            self.warm_fn(new_model, args)
+        self.model = new_model
+        logger.info("Hot-reloaded model from %s in %.0f ms", self.model_file, (time.monotonic() - start) * 1000)
+
+
+_watcher = None
+_watcher_lock = threading.Lock()
+
+
+def current_model(model, warm_fn, poll_seconds=10):
+    """Return the most recent model of this worker, starting to watch the model store on first use
+
+    `model` is the model the API has loaded at startup. The watcher is bound to
+    it, so that a model loaded anew by the API (e.g. after a restart) takes over.
+    """
+    global _watcher
+    with _watcher_lock:
+        if _watcher is None or _watcher.initial_model is not model or _watcher.pid != os.getpid():
+            _watcher = ModelWatcher(model, mllaunchpad.get_validated_config(), warm_fn, poll_seconds=poll_seconds)
+        return _watcher.model
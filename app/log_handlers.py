@@ -0,0 +1,98 @@
+"""Logging handlers and filters to keep logging off the request path (see logging_cfg_async.yml)"""
+import atexit
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+
+class AsyncHandler(QueueHandler):
+    """Hands log records to a background thread, which formats and writes them using `handlers`
+
+    The calling thread only puts the record into a bounded in-memory queue. If the
+    queue is full (the handlers can't keep up), records are dropped and counted
+    instead of blocking requests. Messages are formatted in the background, so
+    don't change objects after passing them as logging arguments.
+
+    In dictConfig, reference the wrapped handlers as cfg://handlers.<name>. As
+    dictConfig creates handlers in alphabetical order, this handler's name has
+    to sort after theirs (e.g. "queue").
+    """
+
+    def __init__(self, handlers, queue_size=10000):
+        handlers = [handlers[i] for i in range(len(handlers))]  # Indexing resolves dictConfig's cfg:// references
+        if not all(isinstance(h, logging.Handler) for h in handlers):
+            raise ValueError("AsyncHandler's name must sort after the names of the handlers it wraps")
+        super().__init__(queue.Queue(queue_size))
+        self.targets = handlers
+        self.queue_size = queue_size
+        self.dropped = 0
+        self._start()
+        atexit.register(self.close)
+
+    def _start(self):
+        self.pid = os.getpid()
+        self.listener = QueueListener(self.queue, *self.targets, respect_handler_level=True)
+        self.listener.start()
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        if self.pid != os.getpid():
+            # The listener thread didn't survive forking (e.g. gunicorn --preload), start a new one
+            self.queue = queue.Queue(self.queue_size)
+            self._start()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        if self.listener is not None and self.pid == os.getpid():
+            self.listener.stop()
+            self.listener = None
+            if self.dropped:
+                logging.getLogger(__name__).warning("Dropped %d log records because logging could not keep up",
+                                                    self.dropped)
+        super().close()
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `rate` records per second per message (and a `sample` fraction of them)
+
+    Applies to records below `level` (default: WARNING), so warnings and errors
+    always pass. Messages are told apart by logger name and unformatted message.
+    Buckets of messages not logged for a second (which are full again) are removed,
+    and at most `max_messages` are kept (the least recently logged are removed first).
+    """
+
+    def __init__(self, rate=10, sample=1.0, level="WARNING", max_messages=1000):
+        super().__init__()
+        self.rate = rate
+        self.sample = sample
+        self.level = level if isinstance(level, int) else logging.getLevelName(level)
+        self.max_messages = max_messages
+        self._buckets = OrderedDict()  # Least recently logged message first
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+        if self.sample < 1.0 and random.random() >= self.sample:
+            return False
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.rate, now))
+            tokens = min(self.rate, tokens + (now - last) * self.rate)
+            allowed = tokens >= 1
+            self._buckets[key] = (tokens - 1 if allowed else tokens, now)
+            while self._buckets and (len(self._buckets) > self.max_messages
+                                     or next(iter(self._buckets.values()))[1] <= now - 1):
+                self._buckets.popitem(last=False)
+        return allowed
@@ -1,10 +1,22 @@
 from mllaunchpad import ModelInterface, ModelMakerInterface
-from sklearn.metrics import accuracy_score, confusion_matrix
 from sklearn import tree
-import pandas as pd
+from sklearn.model_selection import GridSearchCV, RandomizedSearchCV
+from collections import Counter
+import numpy as np
+import flask
 import logging
+import time
+from werkzeug.exceptions import BadRequest
 
+from app.batching import get_batcher
+from app.cache import get_cache
+from app.encoders import encode_predictions, posted
 from app.example_import import clean_string
+from app.features import InvalidFeatures, schema_for
+from app.hot_reload import current_model
+from app.tree_engine import CompiledTree
+from app import timing
+from app.timing import timed
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +34,161 @@ logger = logging.getLogger(__name__)
 #
 # Example to trigger batch prediction (not really the idea of an API...):
 # http://127.0.0.1:5000/iris/v0/varieties
+#
+# Vectorized batch prediction: pass lists instead of single values, columnar
+# ({"sepal.length": [4.9, 5.1], ...}), as repeated query parameters or as the
+# JSON body of a POST request (see api.raml):
+# curl -H "Content-Type: application/json" -d '{"sepal.length": [4.9, 6.3], "sepal.width": [2.4, 3.3], "petal.length": [3.3, 6.0], "petal.width": [1, 2.5]}' http://127.0.0.1:5000/iris/v0/varieties
+# All rows are predicted in one call and the result is
+# {"predictions": [{"iris_variety": ...}, ...]} (in input order).
+# When calling the model from Python (e.g. mllaunchpad.predict), a list of
+# rows ([{"sepal.length": 4.9, ...}, ...]) works as well.
+# Send "Accept: application/msgpack" or "Accept: application/vnd.apache.arrow.stream"
+# to get it as MessagePack or as an Arrow column instead (see app/encoders.py).
+#
+# To score large files offline instead, see app/bulk_score.py:
+# python -m app.bulk_score -c tree_cfg.yml input.csv -o scored.csv
+
+FEATURES = ['sepal.length', 'sepal.width', 'petal.length', 'petal.width']
+
+
+def predict_rows(model, rows):
+    """Predict a list of single-row args dicts in one vectorized call"""
+    return model.predict(schema_for(model, FEATURES).matrix(rows)).tolist()
+
+
+def check_chunksizes(chunksizes, data_sources):
+    """Fail before reading any data if a datasource to be read in chunks is cached (expires != 0)
+
+    mllaunchpad refuses to read cached datasources in chunks, which would otherwise
+    only show once training is done and the test data is read.
+    """
+    for name, chunksize in chunksizes.items():
+        if chunksize and name in data_sources and getattr(data_sources[name], 'expires', 0) != 0:
+            raise ValueError('Datasource {} is read in chunks (model:train_options:chunksize), '
+                             'so it needs "expires: 0" in its config'.format(name))
+
+
+def iter_chunks(data_source, chunksize=None):
+    """Yield the datasource's dataframe in chunks of `chunksize` rows, or as a whole if chunksize is not set"""
+    if chunksize:
+        for chunk in data_source.get_dataframe(chunksize=chunksize):
+            yield chunk
+    else:
+        yield data_source.get_dataframe()
+
+
+def load_training_data(data_source, chunksize=None, max_rows=None, seed=0):
+    """Collect features and labels chunk by chunk as compact arrays
+
+    Features are kept as float32 (the precision the tree uses internally anyway)
+    instead of a float64 DataFrame plus the copy made by dropping the label column.
+    With `max_rows`, only a uniform random sample of at most that many rows is kept
+    (reservoir sampling), so memory use is bounded regardless of the dataset size.
+    Without it, all rows are kept, as a decision tree cannot be fitted incrementally:
+    reading in chunks then only avoids holding the whole DataFrame in memory as well.
+    """
+    rng = np.random.RandomState(seed)
+    X_parts, y_parts, columns, seen = [], [], None, 0
+    for df in iter_chunks(data_source, chunksize):
+        columns = [c for c in df.columns if c != 'variety']
+        X_chunk = df[columns].to_numpy(dtype=np.float32)
+        y_chunk = df['variety'].to_numpy()
+        if not max_rows:
+            X_parts.append(X_chunk)
+            y_parts.append(y_chunk)
+        else:
+            if not X_parts:
+                X_parts.append(np.empty((max_rows, len(columns)), dtype=np.float32))
+                y_parts.append(np.empty(max_rows, dtype=y_chunk.dtype))
+            positions = np.arange(seen, seen + len(df))
+            slots = np.where(positions < max_rows, positions, (rng.random_sample(len(df)) * (positions + 1)).astype(int))
+            keep = slots < max_rows
+            X_parts[0][slots[keep]] = X_chunk[keep]
+            y_parts[0][slots[keep]] = y_chunk[keep]
+        seen += len(df)
+    if max_rows:
+        return X_parts[0][:min(seen, max_rows)], y_parts[0][:min(seen, max_rows)], columns
+    return np.concatenate(X_parts), np.concatenate(y_parts), columns
+
+
+def evaluate_in_chunks(model, data_source, chunksize=None):
+    """Compute accuracy and confusion matrix (labels sorted as in scikit-learn) chunk by chunk"""
+    names = list(schema_for(model, FEATURES).names)
+    counts = Counter()
+    for df in iter_chunks(data_source, chunksize):
+        y_pred = model.predict(df[names].to_numpy(dtype=np.float64))
+        counts.update(zip(df['variety'].tolist(), np.asarray(y_pred).tolist()))
+    labels = sorted({true for true, _ in counts} | {pred for _, pred in counts})
+    index = {label: i for i, label in enumerate(labels)}
+    conf = [[0] * len(labels) for _ in labels]
+    for (true, pred), n in counts.items():
+        conf[index[true]][index[pred]] += n
+    correct = sum(n for (true, pred), n in counts.items() if true == pred)
+    return correct / sum(counts.values()), conf
+
+
+def warm_start_grid(param_grid, old_params):
+    """Narrow a parameter grid down to the previous model's values and their neighbours
+
+    For each parameter with an ordered (numeric) list of values, only the old
+    value and the values right next to it are kept. Other parameters are left as
+    they are. The old values are always part of the grid.
+    """
+    def is_number(v):
+        return isinstance(v, (int, float)) and not isinstance(v, bool)
+
+    grid = {}
+    for name, values in param_grid.items():
+        values = list(values)
+        if name in old_params:
+            old = old_params[name]
+            if old not in values:
+                values.append(old)
+            if is_number(old):
+                numbers = sorted(v for v in values if is_number(v))
+                i = numbers.index(old)
+                values = numbers[max(0, i - 1):i + 2] + [v for v in values if not is_number(v)]
+        grid[name] = values
+    return grid
+
+
+def search_hyperparameters(X, y, search_options, old_model=None):
+    """Cross-validated grid or random search using all local cores, returns the best refitted tree and all candidates
+
+    The candidates run in a process pool (joblib). Arrays bigger than 1 MB, such as the
+    training matrix, are memory-mapped by joblib instead of being copied to each process.
+    """
+    param_grid = search_options.get('param_grid') or {}
+    # Only a model found by a previous search tells which values won, the parameters of any
+    # other model are just defaults (which would narrow the grid down to its first values)
+    old_params = getattr(old_model, 'search_params_', None)
+    if old_params and search_options.get('warm_start', True):
+        param_grid = warm_start_grid(param_grid, old_params)
+        logger.info('Searching around the previous model\'s parameters: %s', param_grid)
+
+    estimator = tree.DecisionTreeClassifier(random_state=search_options.get('random_state', 0))
+    common = dict(cv=search_options.get('cv', 5), n_jobs=search_options.get('n_jobs', -1),
+                  pre_dispatch='2*n_jobs')
+    if search_options.get('method', 'grid') == 'random':
+        search = RandomizedSearchCV(estimator, param_grid, n_iter=search_options.get('n_iter', 20),
+                                    random_state=search_options.get('random_state', 0), **common)
+    else:
+        search = GridSearchCV(estimator, param_grid, **common)
+    search.fit(X, y)
+
+    cv = search.cv_results_
+    candidates = [
+        {
+            'params': params,
+            'mean_score': float(cv['mean_test_score'][i]),
+            'mean_fit_seconds': float(cv['mean_fit_time'][i]),
+            'mean_score_seconds': float(cv['mean_score_time'][i]),
+        }
+        for i, params in enumerate(cv['params'])
+    ]
+    logger.info('Best of %d candidates: %s (score %.4f)', len(candidates), search.best_params_, search.best_score_)
+    return search.best_estimator_, candidates
 
 
 class MyExampleModelMaker(ModelMakerInterface):
@@ -31,28 +198,69 @@ class MyExampleModelMaker(ModelMakerInterface):
     def create_trained_model(self, model_conf, data_sources, data_sinks, old_model=None):
         logger.info(clean_string("using our imported module"))
 
-        df = data_sources['petals'].get_dataframe()
-        X = df.drop('variety', axis=1)
-        y = df['variety']
+        train_options = model_conf.get('train_options') or {}
+        timing.configure((train_options.get('timing') or {}).get('enabled', False))
+        chunksizes = train_options.get('chunksize') or {}
+        check_chunksizes(chunksizes, data_sources)
+        with timed('train.fetch'):
+            X, y, columns = load_training_data(data_sources['petals'], chunksizes.get('petals'),
+                                               train_options.get('max_train_rows'))
+
+        search_options = train_options.get('search') or {}
+        if search_options.get('enabled'):
+            with timed('train.search'):
+                my_tree, candidates = search_hyperparameters(X, y, search_options, old_model)
+            my_tree.search_params_ = {name: my_tree.get_params()[name] for name in candidates[0]['params']}
+            my_tree.search_results_ = candidates
+        else:
+            my_tree = tree.DecisionTreeClassifier()
+            with timed('train.fit'):
+                my_tree.fit(X, y)
+        # Remember the training columns to compile the feature schema from. Not as scikit-learn's
+        # feature_names_in_, which would make it warn about the NumPy input of every prediction.
+        my_tree.feature_order = list(columns)
 
-        my_tree = tree.DecisionTreeClassifier()
-        my_tree.fit(X, y)
+        if train_options.get('compile_tree'):
+            with timed('train.compile'):
+                compiled = CompiledTree.from_sklearn(my_tree)
+            for attr in ['search_params_', 'search_results_']:
+                if hasattr(my_tree, attr):
+                    setattr(compiled, attr, getattr(my_tree, attr))
+            start = time.perf_counter()
+            expected = my_tree.predict(X)
+            sklearn_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            if not (compiled.predict(X) == expected).all():
+                raise RuntimeError('Compiled tree predictions differ from the scikit-learn tree')
+            compiled_ms = (time.perf_counter() - start) * 1000
+            logger.info('Using compiled tree with %d nodes (predicted the %d training rows in %.1f ms, '
+                        'scikit-learn: %.1f ms)', compiled.node_count, len(X), compiled_ms, sklearn_ms)
+            if compiled_ms > 1.5 * sklearn_ms:
+                logger.warning('The compiled tree predicts batches slower than scikit-learn (depth %d), '
+                               'consider compile_tree: False for batch and bulk scoring', compiled.max_depth)
+            if train_options.get('tree_arrays'):
+                # Keeps the files of the stored model, which stays in use if this one fails its test.
+                # The prefix must not start with "<name>_<version>", as mllaunchpad copies all such
+                # files of the model store to previous/ whenever a model is stored.
+                compiled.save_arrays(train_options['tree_arrays'],
+                                     'tree_{}_{}'.format(model_conf['name'], model_conf['version']),
+                                     keep=old_model)
+            return compiled
 
         return my_tree
 
     def test_trained_model(self, model_conf, data_sources, data_sinks, model):
-        df = data_sources['petals_test'].get_dataframe()
-        X_test = df.drop('variety', axis=1)
-        y_test = df['variety']
-
-        my_tree = model
-
-        y_predict = my_tree.predict(X_test)
-
-        acc = accuracy_score(y_test, y_predict)
-        conf = confusion_matrix(y_test, y_predict).tolist()
+        train_options = model_conf.get('train_options') or {}
+        chunksizes = train_options.get('chunksize') or {}
+        check_chunksizes(chunksizes, data_sources)
+        with timed('test.score'):
+            acc, conf = evaluate_in_chunks(model, data_sources['petals_test'], chunksizes.get('petals_test'))
 
         metrics = {'accuracy': acc, 'confusion_matrix': conf}
+        if hasattr(model, 'search_results_'):
+            metrics['search'] = {'best_params': model.search_params_, 'candidates': model.search_results_}
+        if (train_options.get('timing') or {}).get('enabled'):
+            timing.log_stats()
 
         return metrics
 
@@ -61,18 +269,78 @@ class MyExampleModel(ModelInterface):
     """Uses the created Data Science Model
     """
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_timing_configured', None)
+        return state
+
     def predict(self, model_conf, data_sources, data_sinks, model, args_dict):
+        if not getattr(self, '_timing_configured', False):
+            # Once per loaded model, before the 'predict' stage is timed, so that its first call is recorded too
+            timing_options = (model_conf.get('predict_options') or {}).get('timing') or {}
+            timing.configure(timing_options.get('enabled', False), timing_options.get('log_every', 0))
+            self._timing_configured = True
+        with timed('predict'):
+            try:
+                return self._predict(model_conf, data_sources, data_sinks, model, args_dict)
+            except InvalidFeatures as e:
+                if flask.has_request_context():
+                    raise BadRequest(str(e)) from e  # The client's fault, not an internal server error
+                raise
+
+    def _predict(self, model_conf, data_sources, data_sinks, model, args_dict):
         logger.info(clean_string("using our imported module"))
 
-        logger.info('Doing "normal" prediction')
-        X = pd.DataFrame({
-            'sepal.length': [args_dict['sepal.length']],
-            'sepal.width': [args_dict['sepal.width']],
-            'petal.length': [args_dict['petal.length']],
-            'petal.width': [args_dict['petal.width']]
-            })
+        predict_options = model_conf.get('predict_options') or {}
+        hot_reload = predict_options.get('hot_reload') or {}
+        if hot_reload.get('enabled'):
+            # Use the latest model retrained into the model store (swapped in after warming it up)
+            model = current_model(model, lambda new_model, args: predict_rows(new_model, [args]),
+                                  poll_seconds=hot_reload.get('poll_seconds', 10))
 
         my_tree = model
-        y = my_tree.predict(X)[0]
+        schema = schema_for(my_tree, FEATURES)
+        if not posted():
+            # The API parses the (repeatable) query parameters as lists, so one value each is a single row
+            args_dict = schema.unwrap(args_dict)
+        if schema.is_batch(args_dict) or posted():
+            with timed('predict.input'):
+                X = schema.matrix(args_dict)
+            logger.info('Doing batch prediction of %d rows', X.shape[0])
+            with timed('predict.inference'):
+                y = my_tree.predict(X)
+            with timed('predict.output'):
+                return encode_predictions('iris_variety', y)
+
+        cache_options = predict_options.get('cache') or {}
+        if cache_options.get('enabled'):
+            cache = get_cache(my_tree, model_conf.get('version'),
+                              capacity=cache_options.get('capacity', 1024),
+                              ttl=cache_options.get('ttl', 0),
+                              decimals=cache_options.get('decimals', 6),
+                              log_every=cache_options.get('log_every', 0))
+            with timed('predict.cache'):
+                key = cache.key(schema, args_dict)
+                hit, y = cache.get(key)
+            if hit:
+                return {'iris_variety': y}
+
+        micro_batch = predict_options.get('micro_batch') or {}
+        if micro_batch.get('enabled'):
+            batcher = get_batcher(my_tree, predict_rows,
+                                  max_wait_ms=micro_batch.get('max_wait_ms', 2),
+                                  max_rows=micro_batch.get('max_rows', 64))
+            schema.row(args_dict)  # Invalid args fail only their own request, not the whole batch
+            with timed('predict.micro_batch'):
+                y = batcher.predict(args_dict)
+        else:
+            logger.info('Doing "normal" prediction')
+            with timed('predict.input'):
+                X = schema.row(args_dict)
+            with timed('predict.inference'):
+                y = my_tree.predict(X)[0]
+
+        if cache_options.get('enabled'):
+            cache.put(key, y)
 
         return {'iris_variety': y}
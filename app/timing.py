@@ -0,0 +1,130 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (in milliseconds) of the histogram buckets, plus one bucket for anything slower
+BUCKETS_MS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """Durations of one stage, counted in fixed buckets
+
+    Percentiles are only known up to their bucket, so they are reported as the bucket's
+    upper bound (e.g. p95_le_ms: 95% of the durations were at most this long).
+    """
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def add(self, ms):
+        self.counts[bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+
+    def percentile(self, p):
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if n and seen >= rank:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return 0.0
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_le_ms": self.percentile(50),
+            "p95_le_ms": self.percentile(95),
+            "p99_le_ms": self.percentile(99),
+            "max_ms": round(self.max_ms, 3),
+        }
+
+
+class _Timer:
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        record(self.stage, (time.perf_counter() - self.start) * 1000)
+
+
+class _NoTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_no_timer = _NoTimer()
+_enabled = False
+_log_every = 0
+_histograms = {}
+_records = 0
+_pid = os.getpid()
+_lock = threading.Lock()
+
+
+def configure(enabled=False, log_every=0):
+    """Switch timing on or off for this process; with `log_every`, log the stats every this many timings (of all stages)"""
+    global _enabled, _log_every
+    _enabled = enabled
+    _log_every = log_every
+
+
+def timed(stage):
+    """Context manager adding the duration of its block to `stage`'s histogram (does nothing while disabled)"""
+    return _Timer(stage) if _enabled else _no_timer
+
+
+def timed_function(stage):
+    """Decorator adding the duration of each call to `stage`'s histogram (does nothing while disabled)"""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record(stage, ms):
+    global _pid, _records
+    with _lock:
+        if _pid != os.getpid():  # Don't report the parent's timings in forked workers
+            _pid = os.getpid()
+            _histograms.clear()
+        histogram = _histograms.get(stage)
+        if histogram is None:
+            histogram = _histograms[stage] = Histogram()
+        histogram.add(ms)
+        _records += 1
+        records = _records
+    if _log_every and records % _log_every == 0:
+        log_stats()
+
+
+def timing_stats():
+    """Summaries of this worker's stage histograms, by stage"""
+    with _lock:
+        return {stage: histogram.summary() for stage, histogram in _histograms.items()}
+
+
+def log_stats():
+    logger.info("Timings of process %s: %s", os.getpid(), timing_stats())
@@ -0,0 +1,356 @@
+"""Latency and throughput benchmark for the API
+
+Starts the API the way server_scripts/run.sh does (gunicorn serving mllaunchpad.wsgi, with the
+settings from the config's deploy:server section and server_scripts/gunicorn_conf.py), replays
+requests against it and writes a JSON report. Two reports can be compared to catch regressions
+of the model code or the server settings before deploying.
+
+Usage:
+  python benchmark.py run config_deploy.yml [-c 1,4,16] [-r 50,200] [-d 10] [-i requests.jsonl] [-o report.json]
+  python benchmark.py compare old_report.json new_report.json [-t 0.1]
+
+The replayed requests are the config's deploy:test_query and, with -i, one request per line of a
+JSONL file, each a JSON object of query parameters (the same format as deploy:server:warmup_file).
+With -c, requests are sent by that many clients in a closed loop, each over one persistent
+connection (as far as the server keeps connections open). With -r, they are sent at a fixed
+rate (open loop) and latencies include the time a request had to wait to be sent, so an overloaded
+server shows up as growing latencies instead of a lower request rate.
+"""
+import argparse
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPException
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import urlopen
+
+from build import evaluate_formula, get_config, server_settings
+
+scriptdir = os.path.dirname(os.path.abspath(__file__))
+gunicorn_conf_file = os.path.join(scriptdir, "server_scripts", "gunicorn_conf.py")
+clock_ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+default_tolerance = 0.1
+
+
+def test_path(config):
+    """Path and query string of the config's test query, as in build.py's LAUNCHPAD_TEST_URL.txt"""
+    base_url = "{}/v{}/".format(config["api"]["name"], str(config["model"]["version"]).split(".")[0])
+    test_url = config["deploy"]["test_query"].lstrip("/")
+    if not test_url.startswith(base_url):
+        test_url = base_url + test_url
+    url = urlsplit("/" + test_url)
+    return url.path, url.query
+
+
+def load_queries(config, requests_file=None):
+    path, query = test_path(config)
+    queries = [path + "?" + query]
+    if requests_file:
+        with open(requests_file) as f:
+            queries.extend(path + "?" + urlencode(json.loads(line)) for line in f if line.strip())
+    return queries
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_command(settings, port):
+    """Gunicorn command line for the deploy:server `settings` (as written by build.py), like run.sh's"""
+    cores = os.cpu_count()
+    workers = evaluate_formula(settings["workers"], cores)
+    threads = evaluate_formula(settings["threads"], cores)
+    # Unset worker class: run.sh's default
+    worker_class = settings["worker_class"] or ("gthread" if int(settings["instances"]) > 1 else "sync")
+    cmd = [sys.executable, "-m", "gunicorn.app.wsgiapp", "-c", gunicorn_conf_file,
+           "--workers", str(workers), "--threads", str(threads), "--worker-class", worker_class,
+           "--timeout", settings["timeout"], "--bind", "127.0.0.1:{}".format(port), "mllaunchpad.wsgi"]
+    if settings["preload"] == "true":
+        cmd.append("--preload")
+    return cmd
+
+
+def start_server(config_file, settings, port):
+    cmd = server_command(settings, port)
+    env = dict(os.environ, LAUNCHPAD_CFG=os.path.abspath(config_file))
+    print("Starting: {}".format(" ".join(cmd)), file=sys.stderr)
+    return subprocess.Popen(cmd, cwd=os.path.dirname(os.path.abspath(config_file)), env=env)
+
+
+def wait_until_ready(base_url, query, server, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("The server exited with code {}".format(server.returncode))
+        try:
+            with urlopen(base_url + query, timeout=5) as response:
+                response.read()
+            return
+        except (URLError, ConnectionError):
+            time.sleep(0.5)
+    raise RuntimeError("The server did not answer {} within {} seconds".format(query, timeout))
+
+
+def worker_pids(master_pid):
+    pids = []
+    if not os.path.isdir("/proc"):
+        return pids  # Per-worker CPU/RSS are only reported on Linux
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open("/proc/{}/stat".format(entry)) as f:
+                    if int(f.read().rsplit(")", 1)[1].split()[1]) == master_pid:
+                        pids.append(int(entry))
+            except (OSError, IndexError, ValueError):
+                pass
+    return sorted(pids)
+
+
+def process_usage(pid):
+    """(CPU seconds, RSS in MB) of a process, read from /proc"""
+    with open("/proc/{}/stat".format(pid)) as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu_seconds = (int(fields[11]) + int(fields[12])) / clock_ticks
+    rss_mb = 0.0
+    with open("/proc/{}/status".format(pid)) as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss_mb = int(line.split()[1]) / 1024
+    return cpu_seconds, rss_mb
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+class LoadRun:
+    """Sends the queries round-robin for `duration` seconds and records latencies and errors"""
+
+    def __init__(self, base_url, queries, duration):
+        self.base_url = base_url
+        self.queries = queries
+        self.duration = duration
+        self.latencies = []
+        self.errors = 0
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def next_query(self):
+        with self._lock:
+            query = self.queries[self._next % len(self.queries)]
+            self._next += 1
+            return query
+
+    def connect(self):
+        url = urlsplit(self.base_url)
+        return HTTPConnection(url.hostname, url.port, timeout=30)
+
+    def request(self, scheduled=None, connection=None):
+        """Sends the next query, over `connection` (kept open for the following requests) if given"""
+        query = self.next_query()
+        start = time.monotonic()
+        try:
+            if connection is None:
+                with urlopen(self.base_url + query, timeout=30) as response:
+                    response.read()
+                ok = True
+            else:
+                # Reconnects by itself if the server has closed the connection (e.g. gunicorn's sync workers)
+                connection.request("GET", query)
+                response = connection.getresponse()
+                response.read()
+                ok = response.status < 400
+        except (HTTPError, URLError, HTTPException, ConnectionError, socket.timeout):
+            if connection is not None:
+                connection.close()  # Start over with a new connection
+            ok = False
+        latency = time.monotonic() - (scheduled or start)
+        with self._lock:
+            if ok:
+                self.latencies.append(latency)
+            else:
+                self.errors += 1
+
+    def closed_loop(self, concurrency):
+        end = time.monotonic() + self.duration
+
+        def client():
+            connection = self.connect()
+            try:
+                while time.monotonic() < end:
+                    self.request(connection=connection)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def open_loop(self, rate, max_in_flight=256):
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_in_flight) as pool:
+            for i in range(int(rate * self.duration)):
+                scheduled = start + i / rate
+                delay = scheduled - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.request, scheduled)
+
+
+def measure(base_url, queries, duration, master_pid, mode, value):
+    pids = worker_pids(master_pid) if master_pid else []
+    before = {pid: process_usage(pid)[0] for pid in pids}
+    run = LoadRun(base_url, queries, duration)
+    start = time.monotonic()
+    if mode == "concurrency":
+        run.closed_loop(value)
+    else:
+        run.open_loop(value)
+    elapsed = time.monotonic() - start
+    workers = []
+    for pid in pids:
+        try:
+            cpu_seconds, rss_mb = process_usage(pid)
+        except OSError:
+            continue  # Restarted worker (e.g. max_requests)
+        workers.append({"pid": pid, "cpu_percent": round(100 * (cpu_seconds - before[pid]) / elapsed, 1),
+                        "rss_mb": round(rss_mb, 1)})
+    latencies = sorted(run.latencies)
+    ms = lambda seconds: None if seconds is None else round(seconds * 1000, 3)
+    result = {
+        "mode": mode,
+        "value": value,
+        "requests": len(latencies),
+        "errors": run.errors,
+        "rps": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "p50": ms(percentile(latencies, 50)),
+            "p95": ms(percentile(latencies, 95)),
+            "p99": ms(percentile(latencies, 99)),
+            "max": ms(latencies[-1] if latencies else None),
+        },
+        "workers": workers,
+    }
+    print("{} {}: {} requests ({} errors), {} req/s, p50 {} ms, p95 {} ms, p99 {} ms".format(
+        mode, value, result["requests"], result["errors"], result["rps"], result["latency_ms"]["p50"],
+        result["latency_ms"]["p95"], result["latency_ms"]["p99"]), file=sys.stderr)
+    return result
+
+
+def run_benchmark(args):
+    config, _ = get_config(args.config_file)
+    settings = dict(item.split("=", 1) for item in server_settings(config["deploy"].get("server")).splitlines())
+    queries = load_queries(config, args.input)
+    port = args.port or free_port()
+    base_url = "http://127.0.0.1:{}".format(port)
+    server = start_server(args.config_file, settings, port)
+    try:
+        wait_until_ready(base_url, queries[0], server)
+        if args.warmup:
+            LoadRun(base_url, queries, args.warmup).closed_loop(max(args.concurrency or [1]))
+        levels = [("concurrency", c) for c in args.concurrency] + [("rate", r) for r in args.rate]
+        results = [measure(base_url, queries, args.duration, server.pid, mode, value) for mode, value in levels]
+    finally:
+        server.terminate()
+        server.wait()
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": platform.node(),
+        "cores": os.cpu_count(),
+        "python": platform.python_version(),
+        "config_file": args.config_file,
+        "model_version": str(config["model"]["version"]),
+        "server": settings,
+        "queries": len(queries),
+        "duration": args.duration,
+        "results": results,
+    }
+    report_str = json.dumps(report, indent=2) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report_str)
+    else:
+        sys.stdout.write(report_str)
+
+
+def compare_reports(args):
+    with open(args.old_report) as f:
+        old = json.load(f)
+    with open(args.new_report) as f:
+        new = json.load(f)
+    old_results = {(r["mode"], r["value"]): r for r in old["results"]}
+    regressions = 0
+    print("{:<18}{:>10}{:>12}{:>12}{:>9}".format("level", "metric", "old", "new", "change"))
+    for result in new["results"]:
+        previous = old_results.get((result["mode"], result["value"]))
+        if previous is None:
+            continue
+        level = "{} {}".format(result["mode"], result["value"])
+        metrics = [("rps", previous["rps"], result["rps"], -1)]
+        metrics += [(p, previous["latency_ms"][p], result["latency_ms"][p], 1) for p in ["p50", "p95", "p99"]]
+        for metric, old_value, new_value, worse_direction in metrics:
+            if not old_value or new_value is None:
+                continue
+            change = (new_value - old_value) / old_value
+            regressed = change * worse_direction > args.tolerance
+            regressions += regressed
+            print("{:<18}{:>10}{:>12}{:>12}{:>8.1f}%{}".format(
+                level, metric, old_value, new_value, change * 100, "  REGRESSION" if regressed else ""))
+        if result["errors"] > previous["errors"]:
+            regressions += 1
+            print("{:<18}{:>10}{:>12}{:>12}{:>9}  REGRESSION".format(
+                level, "errors", previous["errors"], result["errors"], ""))
+    if regressions:
+        print("{} regression(s) beyond {:.0f}%.".format(regressions, args.tolerance * 100))
+        sys.exit(1)
+
+
+def int_list(value):
+    return [int(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API's latency and throughput.")
+    commands = parser.add_subparsers(dest="command")
+    run = commands.add_parser("run", help="Start the API using gunicorn, replay requests, write a JSON report")
+    run.add_argument("config_file")
+    run.add_argument("-c", "--concurrency", type=int_list, default=[1, 4, 16],
+                     help="Comma-separated numbers of concurrent clients (closed loop), default 1,4,16")
+    run.add_argument("-r", "--rate", type=int_list, default=[],
+                     help="Comma-separated request rates per second (open loop)")
+    run.add_argument("-d", "--duration", type=float, default=10, help="Seconds per level, default 10")
+    run.add_argument("-w", "--warmup", type=float, default=2,
+                     help="Seconds of unmeasured requests before the first level, default 2")
+    run.add_argument("-i", "--input", help="JSONL file with query parameters of additional requests to replay")
+    run.add_argument("-p", "--port", type=int, help="Local port to use, default: any free port")
+    run.add_argument("-o", "--output", help="Report file, default: standard output")
+    compare = commands.add_parser("compare", help="Compare two reports, exit with 1 on regressions")
+    compare.add_argument("old_report")
+    compare.add_argument("new_report")
+    compare.add_argument("-t", "--tolerance", type=float, default=default_tolerance,
+                         help="Relative change counted as regression, default {}".format(default_tolerance))
+    args = parser.parse_args()
+    if args.command == "run":
+        run_benchmark(args)
+    elif args.command == "compare":
+        compare_reports(args)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
 import datetime
+import hashlib
+import json
 import os
 import shutil
+import struct
 import pkg_resources
 import platform
 import re
 import subprocess
 import sys
+import tempfile
 import venv
-from contextlib import contextmanager
+import zlib
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from glob import glob
 from packaging.utils import canonicalize_name
 from typing import Dict, List
-from zipfile import ZipFile
+from zipfile import ZIP64_LIMIT, ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
 
 import yaml
 
@@ -51,7 +57,15 @@ pip_command_file_name = "LAUNCHPAD_REQ_INSTALL.txt"
 pip_cert_file_name = "LAUNCHPAD_PIP_CERT.txt"
 base_url_file_name = "LAUNCHPAD_BASE_URL.txt"
 test_url_file_name = "LAUNCHPAD_TEST_URL.txt"
+server_config_file_name = "LAUNCHPAD_SERVER.txt"
+manifest_file_name = "LAUNCHPAD_MANIFEST.json"
+npy_columns_file_name = "columns.json"
 frozen_infix = "_frozen"
+# Files with these extensions are already compressed and are stored as they are in the deployment artifact
+compressed_extensions = (".whl", ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".jpg", ".jpeg", ".png")
+default_wheel_cache = "~/.mllaunchpad_wheel_cache"  # Override with deploy:requirements:wheel_cache ("" to disable)
+wheel_cache_index_name = "index.json"
+default_download_workers = 4  # Parallel 'pip download' processes, override with deploy:requirements:download_workers
 constrain_download = False  # Experimental: specify python version and python implementation in 'pip download' command
 
 # Unfortunately, some packages have BUILD requirements that they don't
@@ -68,6 +82,25 @@ patch_requirements = {
     # "pandas": ["Cython"],
 }
 yes_to_all = False
+keep_build_env = False  # Set by the -k/--keep-env option
+build_env_marker_name = "LAUNCHPAD_BUILD_ENV.json"
+
+# Gunicorn settings that can be given in the config's optional deploy:server section
+# (with their defaults). They are written to the artifact for run.sh to apply.
+# In workers and threads, "cores" stands for the number of CPU cores of the server.
+server_defaults = {
+    "workers": "4",
+    "threads": "1",
+    "worker_class": "",  # run.sh uses sync for one instance and gthread for several
+    "max_requests": "0",
+    "max_requests_jitter": "0",
+    "timeout": "30",
+    "preload": "false",
+    "warmup_rounds": "0",
+    "warmup_file": "",
+    "instances": "1",
+    "micro_cache": "0",
+}
 
 
 def user_confirms(prompt):
@@ -108,19 +141,76 @@ def validate_config(config_dict, required, path=""):
         validate_config(config_dict[item], required[item], path_start + item)
 
 
-@contextmanager
-def python_interpreter():
-    print("Creating temporary environment {}...".format(venv_location))
-    venv.create(venv_location, clear=True, with_pip=True)
-    interpreter = os.path.join(
-        venv_location,
-        "Scripts" if platform.system() == "Windows" else "bin",
-        "python")
-    try:
-        yield interpreter
-    finally:
-        print("Removing temporary environment {}".format(venv_location))
-        delete_dir(venv_location)
+def build_env_key(req_file):
+    sha = hashlib.sha256()
+    with open(req_file, "rb") as f:
+        sha.update(f.read())
+    sha.update("{}|{}|{}".format(sys.version, sys.executable, platform.platform()).encode())
+    return sha.hexdigest()[:12]
+
+
+class BuildEnvironment:
+    """The virtual environment that the build steps (training, vulnerability check, downloading wheels) run in.
+
+    Use it as a context manager and pass it to the steps, so that a build creates and
+    installs into only one environment. It is only created when a step first has to
+    install something, so a build whose wheels all come from the wheel cache, and which
+    does not train, needs no network access if the vulnerability check's 'safety' is
+    already installed (in an environment kept using keep=True) and uses a local database.
+    With keep=True, the environment is kept after the build at a location keyed on the
+    contents of req_file and the Python version, and reused by later builds. Otherwise,
+    it is removed when leaving the context.
+    """
+
+    def __init__(self, req_file=None, keep=False):
+        self.keep = keep and req_file is not None
+        self.location = "{}_{}".format(venv_location, build_env_key(req_file)) if self.keep else venv_location
+        self.marker_file = os.path.join(self.location, build_env_marker_name) if self.keep else None
+        self.interpreter = os.path.join(
+            self.location,
+            "Scripts" if platform.system() == "Windows" else "bin",
+            "python")
+        self.installed = []
+        self.created = False
+
+    def __enter__(self):
+        if self.keep and os.path.exists(self.marker_file):
+            print("Reusing build environment {}...".format(self.location))
+            with open(self.marker_file) as f:
+                self.installed = json.load(f)
+            self.created = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.created and not self.keep:
+            print("Removing temporary environment {}".format(self.location))
+            delete_dir(self.location)
+
+    def create(self):
+        if self.keep:
+            for stale_location in glob("{}_*".format(venv_location)):
+                print("Removing outdated build environment {}".format(stale_location))
+                delete_dir(stale_location)
+        print("Creating {} environment {}...".format("build" if self.keep else "temporary", self.location))
+        venv.create(self.location, clear=True, with_pip=True)
+        self.created = True
+
+    def pip_install_once(self, req_cfg, params, error_message, key=None):
+        """Runs 'pip install <params>' unless the same has already been installed into this environment."""
+        key = key or " ".join(params)
+        if key in self.installed:
+            print("Already installed in build environment: {}".format(key))
+            return
+        if not self.created:
+            self.create()
+        try:
+            run_pip(self.interpreter, req_cfg, ["install", *params])
+        except subprocess.CalledProcessError:
+            raise RuntimeError(error_message)
+        self.installed.append(key)
+        if self.marker_file:
+            with open(self.marker_file, "w") as f:
+                json.dump(self.installed, f, indent=1)
 
 
 class RequirementsNeedFreezing(Exception):
@@ -217,109 +307,214 @@ def pip_extra_options(req_cfg: Dict) -> List[str]:
     return ["--disable-pip-version-check", *url_params]
 
 
-def run_pip(interpreter, req_cfg, params):
+def run_pip(interpreter, req_cfg, params, echo=True):
     cmd = [interpreter, "-m", "pip", *params, *pip_extra_options(req_cfg)]
-    print(" ".join(cmd))
+    if echo:
+        print(" ".join(cmd))
     output = subprocess.check_output(cmd).decode('ISO-8859-1')
-    print(output)
+    if echo:
+        print(output)
     return output
 
 
-def install_reqs(interpreter, config):
+def install_reqs(env, config):
     req_cfg = config["deploy"]["requirements"]
     req_file = req_cfg["file"]
 
     print("Installing requirements from {}...".format(req_file))
-    pip_params = ["install", "--upgrade", "-r", req_file]
-    try:
-        run_pip(interpreter, req_cfg, pip_params)
-    except subprocess.CalledProcessError:
-        raise RuntimeError("An error occurred when installing the requirements.")
+    pip_params = ["--upgrade", "-r", req_file]
+    env.pip_install_once(req_cfg, pip_params, "An error occurred when installing the requirements.",
+                         key="{} ({})".format(req_file, build_env_key(req_file)))
 
 
-def dependency_vulnerability_check(req_cfg):
+def dependency_vulnerability_check(env, req_cfg):
     req_file = req_cfg["file"]
     print("Checking dependencies file {} for vulnerabilities...".format(req_file))
-    with python_interpreter() as interpreter:
-        inst_params = ["install", "--upgrade", "safety"]
-        try:
-            run_pip(interpreter, req_cfg, inst_params)
-        except subprocess.CalledProcessError:
-            raise RuntimeError("An error occurred when installing the 'safety' vulnerability check package.")
-        check_cmd = [interpreter, "-m", "safety", "check", "-r", req_file, "--full-report"]
-        if "vulnerability_db" in req_cfg and req_cfg["vulnerability_db"]:
-            check_cmd.extend(["--db", req_cfg["vulnerability_db"]])
-        print(" ".join(check_cmd))
-        if subprocess.Popen(check_cmd).wait() == 0:
-            print("No vulnerabilities found.")
-        else:
-            raise AssertionError("Either vulnerabilities found in dependencies or error on executing check. "
-                                 "See above for details.")
+    env.pip_install_once(req_cfg, ["--upgrade", "safety"],
+                         "An error occurred when installing the 'safety' vulnerability check package.")
+    check_cmd = [env.interpreter, "-m", "safety", "check", "-r", req_file, "--full-report"]
+    if "vulnerability_db" in req_cfg and req_cfg["vulnerability_db"]:
+        check_cmd.extend(["--db", req_cfg["vulnerability_db"]])
+    print(" ".join(check_cmd))
+    if subprocess.Popen(check_cmd).wait() == 0:
+        print("No vulnerabilities found.")
+    else:
+        raise AssertionError("Either vulnerabilities found in dependencies or error on executing check. "
+                             "See above for details.")
+
 
+DownloadResult = namedtuple("DownloadResult", ["requirement", "file", "platform", "is_wheel", "log"])
 
-def get_requirements(req_cfg):
-    req_file, py_ver, target_platforms, target_dir = req_cfg["file"], req_cfg["python"], req_cfg["platforms"], req_cfg["save_to"]
+
+def download_requirement(interpreter, req_cfg, req_line, target_dir):
+    """Downloads req_line for the first platform tag in the config that yields a wheel.
+
+    Each platform tag is tried in its own temporary directory, so the downloaded file
+    is known without parsing pip's output. Only the wheel (or, if there is none,
+    the source package of the first platform) ends up in target_dir.
+    """
+    py_ver, target_platforms = req_cfg["python"], req_cfg["platforms"]
     req_implementation = req_cfg.get("implementation", None)
-    print("Downloading requirements from {} for platform tags {}...".format(req_file, target_platforms))
-    with python_interpreter() as interpreter:
+    log = []
+    chosen_file, chosen_platform, is_wheel = None, None, False
+    with tempfile.TemporaryDirectory(prefix="build_download_") as tmp_dir:
+        for target_platform in target_platforms:
+            platform_dir = os.path.join(tmp_dir, target_platform)
+            pip_params = ["download"]
+            if constrain_download:
+                pip_params.extend(["--python-version", py_ver])
+                if req_implementation:
+                    pip_params.extend(["--implementation", req_implementation])
+            pip_params.extend(["--platform", target_platform, "--no-deps", "-d", platform_dir, req_line])
+            log.append("pip " + " ".join(pip_params))
+            try:
+                log.append(run_pip(interpreter, req_cfg, pip_params, echo=False))
+            except subprocess.CalledProcessError:
+                raise RuntimeError("An error occurred when downloading the requirement {}.".format(req_line))
+            downloaded = os.listdir(platform_dir) if os.path.isdir(platform_dir) else []
+            if len(downloaded) != 1:
+                raise RuntimeError("Unable to find out whether the package {} could be downloaded.".format(req_line))
+            file = os.path.join(platform_dir, downloaded[0])
+            if file.endswith(".tar.gz") or file.endswith(".zip"):
+                log.append("Platform {} yielded source file {}\n".format(target_platform, downloaded[0]))
+                if chosen_file is None:
+                    chosen_file, chosen_platform = file, target_platform
+            else:
+                log.append("Found a wheel for {} using platform tag {}\n".format(req_line, target_platform))
+                chosen_file, chosen_platform, is_wheel = file, target_platform, True
+                break
+        target_file = os.path.join(target_dir, os.path.basename(chosen_file))
+        shutil.move(chosen_file, target_file)
+    return DownloadResult(req_line, target_file, chosen_platform, is_wheel, "\n".join(log))
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def link_or_copy(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copy2(source, target)
+
+
+def wheel_cache_key(req_line, req_cfg):
+    """Returns the wheel cache key of a pinned requirement (name==version), None if the requirement is not pinned."""
+    match = re.fullmatch(r"([A-Za-z0-9._-]+)(\[[^\]]*\])?==([^*;,]+)", req_line)
+    if not match:
+        return None
+    python = req_cfg["python"] if constrain_download else ""
+    return "{}=={}|{}|{}".format(canonicalize_name(match.group(1)), match.group(3),
+                                 ",".join(req_cfg["platforms"]), python)
+
+
+def load_wheel_cache_index(cache_dir):
+    index_file = os.path.join(cache_dir, wheel_cache_index_name)
+    if not os.path.exists(index_file):
+        return {}
+    with open(index_file) as f:
+        return json.load(f)
+
+
+def save_wheel_cache_index(cache_dir, index):
+    index_file = os.path.join(cache_dir, wheel_cache_index_name)
+    with open(index_file + ".tmp", "w") as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.replace(index_file + ".tmp", index_file)
+
+
+def get_cached_requirement(cache_dir, index, req_line, req_cfg, target_dir):
+    """Puts the cached file for req_line into target_dir if it is in the cache and intact, else returns None."""
+    key = wheel_cache_key(req_line, req_cfg)
+    entry = index.get(key) if key else None
+    if not entry:
+        return None
+    cached_file = os.path.join(cache_dir, "objects", entry["sha256"], entry["file"])
+    if not os.path.exists(cached_file) or file_sha256(cached_file) != entry["sha256"]:
+        print("Ignoring missing or corrupted cache entry {} for {}".format(cached_file, req_line))
+        del index[key]
+        return None
+    target_file = os.path.join(target_dir, entry["file"])
+    link_or_copy(cached_file, target_file)
+    return DownloadResult(req_line, target_file, entry["platform"], entry["is_wheel"],
+                          "Using cached {} for {} (platform tag {})".format(entry["file"], req_line, entry["platform"]))
+
+
+def add_to_wheel_cache(cache_dir, index, result, req_cfg):
+    key = wheel_cache_key(result.requirement, req_cfg)
+    if not key:
+        return
+    sha256 = file_sha256(result.file)
+    object_dir = os.path.join(cache_dir, "objects", sha256)
+    create_dir(object_dir)
+    cached_file = os.path.join(object_dir, os.path.basename(result.file))
+    if not os.path.exists(cached_file):
+        link_or_copy(result.file, cached_file)
+    index[key] = {"file": os.path.basename(result.file), "sha256": sha256,
+                  "platform": result.platform, "is_wheel": result.is_wheel}
+
+
+def get_requirements(env, req_cfg):
+    req_file, target_platforms, target_dir = req_cfg["file"], req_cfg["platforms"], req_cfg["save_to"]
+    download_workers = req_cfg.get("download_workers", default_download_workers)
+    cache_dir = os.path.expanduser(req_cfg.get("wheel_cache", default_wheel_cache) or "")
+    delete_dir(target_dir)
+    create_dir(target_dir)
+    with open(req_file) as rf:
+        req_lines_raw = rf.read().splitlines()
+        req_lines = [l.split(" ")[0] for l in req_lines_raw]
+    req_lines = [l for l in req_lines if l and not l.startswith("#") and not l.startswith("-e")]
+    results = []
+    if cache_dir:
+        print("Looking up requirements from {} in wheel cache {}...".format(req_file, cache_dir))
+        create_dir(cache_dir)
+        index = load_wheel_cache_index(cache_dir)
+        for req_line in req_lines:
+            result = get_cached_requirement(cache_dir, index, req_line, req_cfg, target_dir)
+            if result:
+                print(result.log)
+                results.append(result)
+    missing_lines = [l for l in req_lines if l not in {r.requirement for r in results}]
+    if missing_lines:
+        print("Downloading {} requirements from {} for platform tags {} using {} parallel downloads...".format(
+            len(missing_lines), req_file, target_platforms, download_workers))
         # Workaround for LightGBM 3.2.1 download error due to it assuming availability of the wheel package
+        env.pip_install_once(req_cfg, ["wheel"], "An error occurred when installing the 'wheel' package.")
         try:
-            run_pip(interpreter, req_cfg, ["install", "wheel"])
-        except subprocess.CalledProcessError:
-            raise RuntimeError("An error occurred when installing the 'wheel' package.")
-        delete_dir(target_dir)
-        create_dir(target_dir)
-        source_warnings = []
-        with open(req_file) as rf:
-            req_lines_raw = rf.read().splitlines()
-            req_lines = [l.split(" ")[0] for l in req_lines_raw]
-        for req_line in [l for l in req_lines if not l.startswith("-e")]:
-            source_files = []
-            for target_platform in target_platforms:
-                pip_params = ["download"]
-                if constrain_download:
-                    pip_params.extend(["--python-version", py_ver])
-                    if req_implementation:
-                        pip_params.extend(["--implementation", req_implementation])
-                pip_params.extend(["--platform", target_platform, "--no-deps", "-d", target_dir, req_line])
-                # pip_params = ["download", "--platform", target_platform, "--no-deps", "-d", target_dir, "-r", req_file]
-                # pip_params = ["download", "--platform", target_platform, "--no-deps", "--prefer-binary", "-d", target_dir, "-r", req_file]
-                try:
-                    output = run_pip(interpreter, req_cfg, pip_params)
-                    file_matches = re.findall(r" (?:File was already downloaded|Saved) ([^\n\r]+)[\n\r]", output)
-                    if len(file_matches) != 1:
-                        raise RuntimeError("Unable to find out whether the package {} could be downloaded.".format(req_line))
-                    file = file_matches[0]
-                    if file.endswith(".tar.gz") or file.endswith(".zip"):
-                        print("Platform {} yielded source file {}\n".format(target_platform, file))
-                        source_files.append(file)
-                        source_warnings.append(req_line)
-                    else:
-                        print("Found a wheel for {} using platform tag {}\n".format(req_line, target_platform))
-                        source_warnings = [r for r in source_warnings if r != req_line]
-                        for f in source_files:
-                            try:
-                                os.remove(f)
-                            except FileNotFoundError:
-                                pass
-                        break
-                except subprocess.CalledProcessError:
-                    raise RuntimeError("An error occurred when downloading the requirements.")
-        source_warnings = list(set(source_warnings))  # unique
-        if source_warnings:
-            print("\nWARNING: No matching wheels could be found for the dependencies {}".format(source_warnings))
-            print("so source code packages (tar.gz/zip) have been downloaded instead of wheels.")
-            print("In many cases, such as for pure python packages such as 'dill', this is not a problem.")
-            print("But particularly C-backed packages like 'pandas' would then be tried to be compiled")
-            print("on the target system, probably lacking some build dependencies, and complain about that.")
-            print("While it is possible to install the build dependencies, it is preferable to look at")
-            print("pypi.org whether a previous version of the offending package comes with a wheel for")
-            print("your target platform and then adjust the (frozen) dependencies to this version.")
-            if not user_confirms("\nType 'y' to continue anyway (usually worth a try), Enter to abort. "):
-                sys.exit(0)
+            with ThreadPoolExecutor(max_workers=download_workers) as executor:
+                futures = [executor.submit(download_requirement, env.interpreter, req_cfg, l, target_dir)
+                           for l in missing_lines]
+                for future in as_completed(futures):
+                    result = future.result()
+                    print(result.log)
+                    results.append(result)
+                    if cache_dir:
+                        add_to_wheel_cache(cache_dir, index, result, req_cfg)
+        finally:
+            if cache_dir:
+                save_wheel_cache_index(cache_dir, index)
+    else:
+        print("All requirements have been found in the wheel cache, nothing to download.")
+    source_warnings = sorted(set(r.requirement for r in results if not r.is_wheel))
+    if source_warnings:
+        print("\nWARNING: No matching wheels could be found for the dependencies {}".format(source_warnings))
+        print("so source code packages (tar.gz/zip) have been downloaded instead of wheels.")
+        print("In many cases, such as for pure python packages such as 'dill', this is not a problem.")
+        print("But particularly C-backed packages like 'pandas' would then be tried to be compiled")
+        print("on the target system, probably lacking some build dependencies, and complain about that.")
+        print("While it is possible to install the build dependencies, it is preferable to look at")
+        print("pypi.org whether a previous version of the offending package comes with a wheel for")
+        print("your target platform and then adjust the (frozen) dependencies to this version.")
+        if not user_confirms("\nType 'y' to continue anyway (usually worth a try), Enter to abort. "):
+            sys.exit(0)
 
 
-def get_model(config, config_file):
+def get_model(env, config, config_file):
     store = config["model_store"]["location"]
     if os.path.relpath(store) in [os.path.relpath(os.path.dirname(p)) for p in config["deploy"]["include"] if os.path.dirname(p) != ""]:
         print("\nYour configuration's deploy:include setting specifies to deploy the model store.")
@@ -330,13 +525,256 @@ def get_model(config, config_file):
             print("There is no trained model to deploy, so you either have to train the model now,\n"
                   "or model(s) will have to be trained in the target environment.")
         if user_confirms("Type 'y' to (re)train model {} now, Enter to continue without training: ".format(model_name)):
-            with python_interpreter() as interpreter:
-                install_reqs(interpreter, config)
-                train_cmd = [interpreter, "-m", "mllaunchpad", "-c", config_file, "train"]
-                print(" ".join(train_cmd))
-                train_result = subprocess.Popen(train_cmd).wait()
-                if train_result != 0:
-                    raise RuntimeError("An error occurred when training the model.")
+            install_reqs(env, config)
+            train_cmd = [env.interpreter, "-m", "mllaunchpad", "-c", config_file, "train"]
+            print(" ".join(train_cmd))
+            train_result = subprocess.Popen(train_cmd).wait()
+            if train_result != 0:
+                raise RuntimeError("An error occurred when training the model.")
+
+
+def evaluate_formula(formula, cores):
+    """Evaluates a formula of whole numbers, 'cores', +, -, *, / and parentheses like run.sh does (using bash).
+
+    Division rounds towards zero. Raises ValueError for anything else, such as "cores/0" or "2**".
+    """
+    tokens = re.findall(r"\d+|cores|\S", formula)
+    position = [0]
+
+    def take(expected=None):
+        token = tokens[position[0]] if position[0] < len(tokens) else None
+        if token is None or (expected and token not in expected):
+            raise ValueError("expected {} at position {} of '{}'".format(
+                " or ".join(expected) if expected else "more", position[0] + 1, formula))
+        position[0] += 1
+        return token
+
+    def peek():
+        return tokens[position[0]] if position[0] < len(tokens) else None
+
+    def factor():
+        token = take()
+        if token == "(":
+            value = expression()
+            take([")"])
+            return value
+        if token == "cores":
+            return cores
+        if token.isdigit():
+            return int(token)
+        raise ValueError("unexpected '{}' in '{}'".format(token, formula))
+
+    def term():
+        value = factor()
+        while peek() in ("*", "/"):
+            operator, operand = take(), factor()
+            if operator == "*":
+                value *= operand
+            elif operand == 0:
+                raise ValueError("division by zero in '{}'".format(formula))
+            else:
+                value = abs(value) // abs(operand) * (1 if (value < 0) == (operand < 0) else -1)
+        return value
+
+    def expression():
+        value = term()
+        while peek() in ("+", "-"):
+            value = value + term() if take() == "+" else value - term()
+        return value
+
+    result = expression()
+    if peek() is not None:
+        raise ValueError("unexpected '{}' in '{}'".format(peek(), formula))
+    return result
+
+
+def server_settings(server_cfg):
+    settings = dict(server_defaults)
+    for key, value in (server_cfg or {}).items():
+        if key not in server_defaults:
+            raise ValueError("Unknown key in config file: deploy:server:{} (known keys: {})".format(
+                key, ", ".join(server_defaults)))
+        settings[key] = str(value).lower() if isinstance(value, bool) else str(value)
+    for key in ["workers", "threads"]:
+        try:
+            single_core_value = evaluate_formula(settings[key], cores=1)
+        except ValueError as e:
+            raise AssertionError("Config error: {} must be a number or a formula using 'cores', {} (deploy:server:{}: {})".format(
+                key, e, key, settings[key]))
+        if single_core_value < 1:
+            raise AssertionError("Config error: {} must be at least 1, also on a single core (deploy:server:{}: {})".format(
+                key, key, settings[key]))
+    for key in ["max_requests", "max_requests_jitter", "timeout", "warmup_rounds", "instances", "micro_cache"]:
+        if not settings[key].isdigit():
+            raise AssertionError("Config error: {} must be a whole number (deploy:server:{}: {})".format(
+                key, key, settings[key]))
+    if settings["worker_class"] and not re.fullmatch(r"[a-zA-Z0-9_.]+", settings["worker_class"]):
+        raise AssertionError("Config error: invalid worker class (deploy:server:worker_class: {})".format(
+            settings["worker_class"]))
+    if int(settings["instances"]) < 1:
+        raise AssertionError("Config error: instances must be at least 1 (deploy:server:instances: {})".format(
+            settings["instances"]))
+    if int(settings["instances"]) > 1 and settings["worker_class"] == "sync" and settings["threads"] == "1":
+        print("WARNING: Sync workers close each connection after one request, so nginx can't keep connections to "
+              "the {} instances alive (deploy:server). Consider worker_class: gthread.".format(settings["instances"]))
+    if settings["warmup_file"] and not os.path.isfile(settings["warmup_file"]):
+        raise AssertionError("Config error: warm-up file not found (deploy:server:warmup_file: {})".format(
+            settings["warmup_file"]))
+    return "\n".join("{}={}".format(k, v) for k, v in settings.items()) + "\n"
+
+
+def get_artifact_files(deploy_cfg):
+    exclude = deploy_cfg.get("exclude") or []
+    exclude_regex = re.compile("|".join(re.escape(e) for e in exclude)) if exclude else None
+    files = []
+    for file_pattern in deploy_cfg["include"]:
+        expanded_files = glob(file_pattern, recursive=True)
+        files.extend(f for f in expanded_files if not exclude_regex or not exclude_regex.search(f))
+    return files
+
+
+def read_manifest(zip_path):
+    """Returns the manifest and the members of a previously built artifact (empty if there is none)."""
+    if not zip_path or not os.path.exists(zip_path):
+        return {}, {}
+    try:
+        with ZipFile(zip_path) as zip_file:
+            members = {info.filename: info for info in zip_file.infolist()}
+            if manifest_file_name not in members:
+                return {}, {}
+            return json.loads(zip_file.read(manifest_file_name).decode("utf-8")), members
+    except (OSError, ValueError) as e:
+        print("Not reusing previous artifact {}: {}".format(zip_path, e))
+        return {}, {}
+
+
+def prepare_member(path, arcname, previous_manifest, previous_members):
+    """Hashes a file and, unless it can be reused from the previous artifact, compresses it.
+
+    Returns (zinfo, sha256, compressed) with compressed being a temporary file with the raw member data,
+    or None if the member can be copied from the previous artifact as is.
+    """
+    zinfo = ZipInfo.from_file(path, arcname)
+    zinfo.compress_type = ZIP_STORED if path.lower().endswith(compressed_extensions) else ZIP_DEFLATED
+    sha256 = file_sha256(path)
+    previous = previous_members.get(zinfo.filename)
+    if previous and previous_manifest.get(zinfo.filename, {}).get("sha256") == sha256 \
+            and previous.compress_type == zinfo.compress_type:
+        zinfo.CRC, zinfo.compress_size = previous.CRC, previous.compress_size
+        return zinfo, sha256, None
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15) \
+        if zinfo.compress_type == ZIP_DEFLATED else None
+    compressed = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    crc = 0
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            crc = zlib.crc32(block, crc)
+            compressed.write(compressor.compress(block) if compressor else block)
+    if compressor:
+        compressed.write(compressor.flush())
+    zinfo.CRC, zinfo.compress_size = crc, compressed.tell()
+    compressed.seek(0)
+    return zinfo, sha256, compressed
+
+
+def writes_raw_members(zip_file):
+    """Whether write_raw_member can write zip_file directly (it uses zipfile internals, not its public API)."""
+    return hasattr(ZipInfo, "FileHeader") and not getattr(zip_file, "_writing", False) \
+        and all(hasattr(zip_file, name) for name in ("fp", "filelist", "NameToInfo", "start_dir"))
+
+
+def copy_raw_member(zip_file, zinfo, raw_file):
+    """Like write_raw_member, but using zipfile's public API, which means decompressing and compressing again."""
+    decompressor = zlib.decompressobj(-15) if zinfo.compress_type == ZIP_DEFLATED else None
+    target_info = ZipInfo(zinfo.filename, zinfo.date_time)
+    target_info.compress_type = zinfo.compress_type
+    target_info.external_attr = zinfo.external_attr
+    remaining = zinfo.compress_size
+    with zip_file.open(target_info, "w", force_zip64=zinfo.file_size > ZIP64_LIMIT) as target:
+        while remaining > 0:
+            block = raw_file.read(min(remaining, 1024 * 1024))
+            if not block:
+                raise IOError("Unexpected end of data for {}".format(zinfo.filename))
+            target.write(decompressor.decompress(block) if decompressor else block)
+            remaining -= len(block)
+        if decompressor:
+            target.write(decompressor.flush())
+
+
+def write_raw_member(zip_file, zinfo, raw_file):
+    """Writes an already compressed member to zip_file, reading zinfo.compress_size bytes from raw_file."""
+    if not writes_raw_members(zip_file):
+        copy_raw_member(zip_file, zinfo, raw_file)
+        return
+    zinfo.flag_bits &= ~0x08  # sizes are in the header, no data descriptor
+    zinfo.header_offset = zip_file.fp.tell()
+    zip64 = zinfo.file_size > ZIP64_LIMIT or zinfo.compress_size > ZIP64_LIMIT
+    zip_file.fp.write(zinfo.FileHeader(zip64))
+    remaining = zinfo.compress_size
+    while remaining > 0:
+        block = raw_file.read(min(remaining, 1024 * 1024))
+        if not block:
+            raise IOError("Unexpected end of data for {}".format(zinfo.filename))
+        zip_file.fp.write(block)
+        remaining -= len(block)
+    zip_file.filelist.append(zinfo)
+    zip_file.NameToInfo[zinfo.filename] = zinfo
+    zip_file.start_dir = zip_file.fp.tell()
+
+
+def seek_raw_member(zip_fp, zinfo):
+    """Positions zip_fp at the start of the raw (compressed) data of member zinfo."""
+    zip_fp.seek(zinfo.header_offset)
+    name_length, extra_length = struct.unpack("<HH", zip_fp.read(30)[26:30])
+    zip_fp.seek(zinfo.header_offset + 30 + name_length + extra_length)
+    return zip_fp
+
+
+def package_artifact(zip_name, files, generated, previous_zip=None):
+    """Writes the deployment artifact zip_name.
+
+    files are paths or (path, arcname) tuples, generated is a list of (arcname, string) tuples.
+    Files are hashed and compressed in parallel, already compressed formats are stored as they are,
+    and members that are unchanged since previous_zip (according to its manifest) are copied from it
+    without compressing them again. A manifest with the hashes of all members is added.
+    """
+    previous_manifest, previous_members = read_manifest(previous_zip)
+    manifest = {}
+    reused = 0
+    with ZipFile(zip_name, "w") as zip_file, \
+            ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor, \
+            open(previous_zip if previous_members else os.devnull, "rb") as previous_fp:
+        futures = []
+        for file in files:
+            path, arcname = file if isinstance(file, tuple) else (file, None)
+            if os.path.isdir(path):
+                print("Adding directory {}".format(path))
+                zip_file.write(path, arcname=arcname)
+            else:
+                futures.append((path, executor.submit(prepare_member, path, arcname,
+                                                      previous_manifest, previous_members)))
+        for path, future in futures:
+            zinfo, sha256, compressed = future.result()
+            if compressed is None:
+                print("Reusing file {} from previous artifact".format(path))
+                write_raw_member(zip_file, zinfo, seek_raw_member(previous_fp, previous_members[zinfo.filename]))
+                reused += 1
+            else:
+                print("Adding file {}{}".format(path, "" if zinfo.filename == path.replace(os.sep, "/")
+                                                else " as {}".format(zinfo.filename)))
+                with compressed:
+                    write_raw_member(zip_file, zinfo, compressed)
+            manifest[zinfo.filename] = {"sha256": sha256, "size": zinfo.file_size}
+        for arcname, content in generated:
+            print("Adding file {}".format(arcname))
+            data = content.encode("utf-8")
+            zip_file.writestr(arcname, data, compress_type=ZIP_DEFLATED)
+            manifest[arcname] = {"sha256": hashlib.sha256(data).hexdigest(), "size": len(data)}
+        print("Adding file {}".format(manifest_file_name))
+        zip_file.writestr(manifest_file_name, json.dumps(manifest, indent=1, sort_keys=True),
+                          compress_type=ZIP_DEFLATED)
+    if previous_members:
+        print("Reused {} of {} files from previous artifact {}".format(reused, len(futures), previous_zip))
 
 
 def get_config(config_file):
@@ -390,8 +828,9 @@ def freeze_reqs(config_file):
     """Returns True if config has been changed and can be reloaded, False if user has to handle this themselves."""
     config, config_str = get_config(config_file)
 
-    with python_interpreter() as interpreter:
-        install_reqs(interpreter, config)
+    # Always freeze in a new environment, as the build environment contains build tools like 'safety'
+    with BuildEnvironment() as env:
+        install_reqs(env, config)
         old_reqs_file = config["deploy"]["requirements"]["file"]
         if "{}.".format(frozen_infix) in old_reqs_file:
             frozen_reqs_file = old_reqs_file
@@ -399,7 +838,7 @@ def freeze_reqs(config_file):
             frozen_reqs_file_name, ext = os.path.splitext(old_reqs_file)
             frozen_reqs_file = "{}{}{}".format(frozen_reqs_file_name, frozen_infix, ext)
 
-        freeze_cmd = [interpreter, "-m", "pip", "freeze", "--all"]  # --all is needed for setuptools, wheel
+        freeze_cmd = [env.interpreter, "-m", "pip", "freeze", "--all"]  # --all is needed for setuptools, wheel
         try:
             print(" ".join(freeze_cmd) + " > " + frozen_reqs_file)
             freeze_output = subprocess.check_output(freeze_cmd).decode('ISO-8859-1')
@@ -443,13 +882,61 @@ def freeze_reqs(config_file):
     return False
 
 
+def write_npy_columns(df, directory):
+    """Writes a DataFrame as a directory of one .npy file per column (see the npy datasource in app/datasources.py)."""
+    import numpy as np  # only needed for converting datasources
+
+    create_dir(directory)
+    columns = []
+    for i, name in enumerate(df.columns):
+        values = df[name].to_numpy()
+        if values.dtype == object:
+            values = values.astype(str)  # fixed-width unicode, which (unlike objects) can be memory-mapped
+        file_name = "{}.npy".format(i)
+        np.save(os.path.join(directory, file_name), np.ascontiguousarray(values), allow_pickle=False)
+        columns.append({"name": str(name), "file": file_name, "dtype": values.dtype.str})
+    with open(os.path.join(directory, npy_columns_file_name), "w") as f:
+        json.dump({"rows": len(df), "columns": columns}, f, indent=1)
+
+
+def convert_datasources(config_file):
+    """Converts the config's local csv datasources into the columnar npy format."""
+    import pandas as pd  # only needed for converting datasources
+
+    with open(config_file) as f:
+        config = yaml.safe_load(f)
+    old_working_dir = os.getcwd()
+    os.chdir(os.path.abspath(os.path.dirname(config_file)))
+    converted = {}
+    for name, ds_cfg in (config.get("datasources") or {}).items():
+        path = ds_cfg.get("path", "")
+        if ds_cfg.get("type") != "csv" or re.match(r"^[a-z0-9]+://", path) or not os.path.exists(path):
+            print("Skipping datasource {} (only local csv files can be converted)".format(name))
+            continue
+        target = "{}_npy".format(os.path.splitext(path)[0])
+        print("Converting datasource {} from {} to {}...".format(name, path, target))
+        df = pd.read_csv(path, **(ds_cfg.get("options") or {}))
+        write_npy_columns(df, target)
+        converted[name] = target, ds_cfg.get("expires", 0)
+    os.chdir(old_working_dir)
+    if converted:
+        print("\nTo use the converted datasources, add 'app.datasources' to the config's plugins:\n"
+              "and change the datasources' type to 'npy', their path and their caching as follows:")
+        for name, (target, expires) in converted.items():
+            print("  {}:\n    type: npy\n    path: {}\n    expires: 0\n    cache_expires: {}".format(
+                name, target, expires))
+
+
 def main():
     # TODO: use Click
     args = sys.argv[1:]
-    global yes_to_all
+    global yes_to_all, keep_build_env
     if "-y" in args or "--yes-to-all" in args:
         yes_to_all = True
         args = [a for a in args if a != "-y" and a != "--yes-to-all"]
+    if "-k" in args or "--keep-env" in args:
+        keep_build_env = True
+        args = [a for a in args if a != "-k" and a != "--keep-env"]
 
     if "-f" in args or "--freeze" in args:
         if len(args) != 2:
@@ -462,6 +949,13 @@ def main():
         freeze_reqs(config_file)
         sys.exit(0)
 
+    if "-c" in args or "--convert" in args:
+        if len(args) != 2:
+            raise ValueError("Converting datasources requires a config file. All local csv datasources in it\n"
+                             "will be converted into the columnar binary npy format (to <filename>_npy/).")
+        convert_datasources([a for a in args if a != "-c" and a != "--convert"][0])
+        sys.exit(0)
+
     if len(args) != 1:
         raise ValueError("Expected single argument with config file.")
     config_file = args[0]
@@ -474,6 +968,8 @@ def main():
             sys.version_info[0], sys.version_info[1], major, minor
         ))
 
+    server_str = server_settings(config["deploy"].get("server"))
+
     root_path = os.path.dirname(config_file)
     old_working_dir = os.getcwd()
     os.chdir(os.path.abspath(root_path))
@@ -493,13 +989,17 @@ def main():
                   "to the frozen requirements and run 'python build.py <config_file> again.")
             sys.exit(0)
 
-    get_model(config, config_file)
+    # All build steps share one environment (which is kept for later builds with -k/--keep-env)
+    with BuildEnvironment(req_cfg["file"], keep=keep_build_env) as env:
+        get_model(env, config, config_file)
+
+        dependency_vulnerability_check(env, req_cfg)
 
-    dependency_vulnerability_check(req_cfg)
+        if "save_to" in req_cfg and req_cfg["save_to"]:
+            get_requirements(env, req_cfg)
 
     files = []
     if "save_to" in req_cfg and req_cfg["save_to"]:
-        get_requirements(req_cfg)
         req_install_str = "pip install --disable-pip-version-check --upgrade --no-index --find-links ./wheels/ -r ./{}".format(deployed_requirements_name)
     else:
         print("NOTE: The server will need to have access to a pip-compatible repository.\n"
@@ -509,54 +1009,43 @@ def main():
             req_cfg["pip_cert"] = pip_cert_file_name
         req_install_str = " ".join(["pip", "install", "--upgrade", "-r", deployed_requirements_name, *pip_extra_options(req_cfg)])
 
-    for file_pattern in config["deploy"]["include"]:
-        expanded_files = glob(file_pattern, recursive=True)
-        filtered_files = []
-        for f in expanded_files:
-            if "exclude" in config["deploy"]:
-                unwanted = [e for e in config["deploy"]["exclude"] if e in f]
-            else:
-                unwanted = []
-            if len(unwanted) == 0:
-                filtered_files.append(f)
-        files.extend(filtered_files)
+    files.extend(get_artifact_files(config["deploy"]))
+
+    generated = [(deployed_config_name, config_str),
+                 (required_python_name, "{}{}".format(major, minor)),
+                 (deployed_requirements_name, req_str),
+                 (pip_command_file_name, req_install_str)]
+    required_files_str = ""
+    if "deployment_requires" in config["deploy"]:
+        required_files_str = "\n".join(config["deploy"]["deployment_requires"]).replace("\\", "/")
+    generated.append((required_files_name, required_files_str))
+    base_url = "{}/v{}/".format(config["api"]["name"],
+                                config["model"]["version"].split(".")[0])
+    generated.append((base_url_file_name, base_url))
+    test_url = config["deploy"]["test_query"]
+    if test_url.startswith("/"):
+        test_url = test_url[1:]
+    if not test_url.startswith(base_url):
+        test_url = base_url + test_url
+    generated.append((test_url_file_name, "/" + test_url))
+    generated.append((server_config_file_name, server_str))
 
-    delete_dir(build_path)
+    # The most recent previous artifact is reused for unchanged files, then the build directory is cleared
     create_dir(build_path)
+    previous_zips = sorted(glob(os.path.join(build_path, "*.zip")), key=os.path.getmtime)
+    previous_zip = previous_zips[-1] if previous_zips else None
     zip_name = os.path.join(build_path, "{}_{}.zip".format(config["model"]["name"], config["model"]["version"]))
+    tmp_zip_name = zip_name + ".tmp"
     print("Packaging zip file {}...".format(zip_name))
-    with ZipFile(zip_name, 'w') as zip_file:
-        for file in files:
-            if isinstance(file, tuple):
-                print("Adding file {} as {}".format(file[0], file[1]))
-                zip_file.write(file[0], arcname=file[1])
+    package_artifact(tmp_zip_name, files, generated, previous_zip)
+    for entry in os.listdir(build_path):
+        entry_path = os.path.join(build_path, entry)
+        if entry_path != tmp_zip_name:
+            if os.path.isdir(entry_path):
+                delete_dir(entry_path)
             else:
-                print("Adding file {}".format(file))
-                zip_file.write(file)
-        print("Adding file {}".format(deployed_config_name))
-        zip_file.writestr(deployed_config_name, config_str)
-        print("Adding file {}".format(required_python_name))
-        zip_file.writestr(required_python_name, "{}{}".format(major, minor))
-        print("Adding file {}".format(deployed_requirements_name))
-        zip_file.writestr(deployed_requirements_name, req_str)
-        print("Adding file {}".format(pip_command_file_name))
-        zip_file.writestr(pip_command_file_name, req_install_str)
-        print("Adding file {}".format(required_files_name))
-        required_files_str = ""
-        if "deployment_requires" in config["deploy"]:
-            required_files_str = "\n".join(config["deploy"]["deployment_requires"]).replace("\\", "/")
-        zip_file.writestr(required_files_name, required_files_str)
-        print("Adding file {}".format(base_url_file_name))
-        base_url = "{}/v{}/".format(config["api"]["name"],
-                                    config["model"]["version"].split(".")[0])
-        zip_file.writestr(base_url_file_name, base_url)
-        print("Adding file {}".format(test_url_file_name))
-        test_url = config["deploy"]["test_query"]
-        if test_url.startswith("/"):
-            test_url = test_url[1:]
-        if not test_url.startswith(base_url):
-            test_url = base_url + test_url
-        zip_file.writestr(test_url_file_name, "/" + test_url)
+                os.remove(entry_path)
+    os.replace(tmp_zip_name, zip_name)
 
     os.chdir(old_working_dir)
     print("\nDone. Build artifacts can be found in the '{}' subdirectory.".format(build_path))
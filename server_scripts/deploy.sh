@@ -75,6 +75,22 @@ do
   echo "Resource '$full_req_file' found" 1>&2
 done
 
+echo "Verifying model store checksums..." 1>&2
+# model_store: location of the deployed config (skipping a YAML anchor like "&model_store"), relative to the API's directory
+model_store="$(awk '/^model_store:/ {section=1; next} /^[^ #]/ {section=0}
+    section && $1 == "location:" {value = ($2 ~ /^&/) ? $3 : $2; gsub(/["'"'"']/, "", value); print value; exit}' "$name/LAUNCHPAD_CFG.yml")"
+case "$model_store" in
+    /*) ;;
+    *) model_store="$name/$model_store" ;;
+esac
+for manifest in "$model_store"/*.sha256; do
+    if [ -f "$manifest" ] && ! (cd "$(dirname "$manifest")" && sha256sum --quiet -c "$(basename "$manifest")"); then
+        echo "ERROR: The model files listed in '$manifest' are damaged or missing. Aborting deployment." 1>&2
+        echo "Type '$0 -h' for help." 1>&2
+        exit 6
+    fi
+done
+
 mypython="$(cat PYTHON.txt)"
 echo "Using Python interpreter at $mypython (from PYTHON.txt)" 1>&2
 
@@ -1,41 +1,81 @@
 #!/usr/bin/bash
 
 port=8000
+howmany=1
+first=
+scriptdir="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
+# Ports handed out are reserved for a while, so that concurrent callers (e.g. several 'run.sh -a')
+# can't get the same port before its API has started listening on it.
+lockfile="$scriptdir/.findport.lock"
+reservations="$scriptdir/.findport_reserved"
+reserve_seconds=120
 
 usage() {
     echo "Usage: $0 [-n <number_of_ports, default: 1>]" 1>&2
     echo "Finds and outputs available port numbers, starting from port $port." 1>&2
-    echo "ATTENTION: If you need many free ports, use the -n option." 1>&2
-    echo "           Don't get single ports and start services on them in a tight loop or you will run into duplicates." 1>&2
+    echo "Ports are reserved for $reserve_seconds seconds after being output, so concurrent calls never return the same port." 1>&2
     echo "Options: -n <number_of_ports>  Outputs this many unique free port numbers (default: 1, max: 1000)." 1>&2
+    echo "         -p <first_port>       Checks that the <number_of_ports> ports from <first_port> on are free" 1>&2
+    echo "                               (and not reserved) instead, and reserves and outputs them." 1>&2
     echo "         -h                    Show this message and exit." 1>&2
 }
 
-while getopts ":nh" o; do
+while getopts ":n:p:h" o; do
     case $o in
-        p)
+        n)
             howmany=$OPTARG
             ;;
+        p)
+            first=$OPTARG
+            ;;
         h)
             usage
             exit 0
             ;;
+        *)
+            usage
+            exit 1
+            ;;
     esac
 done
 
+exec 9>"$lockfile"
+flock 9
+now=$(date +%s)
+touch "$reservations"
+reserved="$(awk -v since=$((now - reserve_seconds)) '$2 >= since' "$reservations")"
+listening="$(ss -lntu | awk 'NR > 1 {print $5}' | sed -r 's/^.*:([0-9]+)$/\1/')"
+used=" $(echo $listening $(cut -d' ' -f1 <<<"$reserved")) "
+
+reserve_found() {
+    { [[ -z "$reserved" ]] || echo "$reserved"; printf "%s $now\n" "${found[@]}"; } > "$reservations"
+    printf "%s\n" "${found[@]}"
+}
+
+found=()
+if [[ -n "$first" ]]; then
+    for ((port = first; port < first + howmany; port++)); do
+        if [[ "$used" == *" $port "* ]]; then
+            echo "ERROR: Port $port is already in use (or reserved). Aborting." 1>&2
+            echo "Type '$0 -h' for help." 1>&2
+            exit 1
+        fi
+        found+=($port)
+    done
+    reserve_found
+    exit 0
+fi
 while [ $port != 9000 ]; do
-   ss -ln | grep -q ":$port "
-   if [ $? != 0 ]; then
-      echo $port
-      let howmany--
-      if (( $howmany <= 0 )); then
-          exit 0
-      fi
-   fi
-   let port++
+    if [[ "$used" != *" $port "* ]]; then
+        found+=($port)
+        if (( ${#found[@]} >= $howmany )); then
+            reserve_found
+            exit 0
+        fi
+    fi
+    let port++
 done
 
 echo "ERROR: Could not find a free port. Aborting." 1>&2
 echo "Type '$0 -h' for help." 1>&2
 exit 1
-
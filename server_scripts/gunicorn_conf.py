@@ -0,0 +1,105 @@
+# Gunicorn settings and server hooks for the deployed APIs (run.sh passes this file using -c).
+# Command line options given by run.sh take precedence over settings in this file.
+import gc
+import json
+import os
+import statistics
+import time
+from urllib.parse import urlencode, urlsplit
+from wsgiref.util import setup_testing_defaults
+
+# Written to the artifact by build.py (from the config's deploy section), read from the API directory
+server_config_file_name = "LAUNCHPAD_SERVER.txt"
+test_url_file_name = "LAUNCHPAD_TEST_URL.txt"
+
+# Warm-up stops once the median latency of a round is within this fraction of the previous round's
+warmup_stable_within = 0.1
+
+
+def when_ready(server):
+    # With preloading (run.sh -s), the app including the model and any preloaded datasources
+    # has already been loaded in the master process. Workers are forked from it and share
+    # these memory pages copy-on-write. Garbage collections in the workers would write to
+    # the objects' headers and thereby copy the pages, so move everything loaded so far out
+    # of the garbage collector's reach (only available in Python 3.7+).
+    if server.cfg.preload_app and hasattr(gc, "freeze"):
+        gc.collect()
+        gc.freeze()
+        server.log.info("Froze %s preloaded objects to keep them shared between workers", gc.get_freeze_count())
+
+
+def read_server_settings():
+    settings = {}
+    if os.path.exists(server_config_file_name):
+        with open(server_config_file_name) as f:
+            for line in f:
+                key, _, value = line.strip().partition("=")
+                settings[key] = value
+    return settings
+
+
+def warmup_queries(warmup_file):
+    """Path and query string of the test query, plus one per line of `warmup_file` (JSON objects of query parameters)"""
+    with open(test_url_file_name) as f:
+        test_url = urlsplit(f.read().strip())
+    queries = [(test_url.path, test_url.query)]
+    if warmup_file:
+        with open(warmup_file) as f:
+            queries.extend((test_url.path, urlencode(json.loads(line))) for line in f if line.strip())
+    return queries
+
+
+def call_app(app, path, query_string):
+    """Make a GET request directly to the WSGI app, return the response status"""
+    environ = {"PATH_INFO": path, "QUERY_STRING": query_string}
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response["status"] = status
+        return lambda data: None
+
+    app_iter = app(environ, start_response)
+    try:
+        for _ in app_iter:
+            pass
+    finally:
+        if hasattr(app_iter, "close"):
+            app_iter.close()
+    return response["status"]
+
+
+def post_worker_init(worker):
+    try:
+        from app.encoders import reject_non_object_bodies
+    except ImportError:
+        pass  # Another model package than this template's app
+    else:
+        reject_non_object_bodies(worker.wsgi)
+
+    # Replay the test query (and deploy:server:warmup_file) through the app before this worker
+    # accepts requests, so that lazy imports, first-call allocations and caches are not paid for
+    # by real requests. Rounds are repeated until the median latency has stabilized.
+    settings = read_server_settings()
+    max_rounds = int(settings.get("warmup_rounds") or 0)
+    if max_rounds <= 0 or not os.path.exists(test_url_file_name):
+        return
+
+    start = time.monotonic()
+    queries = warmup_queries(settings.get("warmup_file"))
+    previous_p50 = None
+    for round_number in range(1, max_rounds + 1):
+        latencies = []
+        for path, query_string in queries:
+            request_start = time.monotonic()
+            status = call_app(worker.wsgi, path, query_string)
+            latencies.append(time.monotonic() - request_start)
+            if not status.startswith("2"):
+                worker.log.warning("Warm-up request %s?%s returned %s", path, query_string, status)
+        worker.notify()  # Keep the master from considering a long warm-up a hung worker
+        p50 = statistics.median(latencies)
+        if previous_p50 is not None and abs(p50 - previous_p50) <= warmup_stable_within * previous_p50:
+            break
+        previous_p50 = p50
+    worker.log.info("Warmed up worker in %.0f ms (%d rounds of %d requests, p50 %.1f ms)",
+                    (time.monotonic() - start) * 1000, round_number, len(queries), p50 * 1000)
@@ -0,0 +1,23 @@
+# Registry of the running APIs, shared by run.sh, stop.sh and status.sh (which source this file).
+# It has one line per Gunicorn instance: api_name,pid,port,base_url,health
+# where health is the result of the last check by run.sh or 'status.sh -c' (starting, healthy or unhealthy).
+# $scriptdir has to be set to the directory of the scripts.
+
+registry="$scriptdir/.registry"
+registry_lock="$scriptdir/.registry.lock"
+
+# Outputs all registered instances
+registry_read() {
+    cat "$registry" 2>/dev/null || true
+}
+
+# Replaces the registered instances of API $1 with the lines read from stdin (none to unregister it)
+registry_replace() {
+    local lines
+    lines="$(cat)"
+    (
+        flock 8
+        { registry_read | awk -F, -v name="$1" '$1 != name'; [[ -z "$lines" ]] || echo "$lines"; } > "$registry.tmp"
+        mv "$registry.tmp" "$registry"
+    ) 8>"$registry_lock"
+}
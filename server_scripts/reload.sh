@@ -9,14 +9,20 @@ usage() {
     echo "This signals HUP to Gunicorn's master process, which will trigger a graceful reload." 2>&2
     echo "NOTE: When (re)deploying a deliverable, use deploy.sh instead" 1>&2
     echo "Options: -t    Train the model before reloading" 1>&2
+    echo "         -w    Train the model, but don't restart the workers. They swap in the new model" 1>&2
+    echo "               themselves if model:predict_options:hot_reload is enabled (zero downtime)." 1>&2
     echo "         -h    Show this message and exit." 1>&2
 }
 
-while getopts "th" o; do
+while getopts "twh" o; do
     case $o in
         t)
             train=true
             ;;
+        w)
+            train=true
+            hot=true
+            ;;
         *)
             usage
             exit 1
@@ -70,9 +76,16 @@ if [ "$train" = "true" ]; then
 fi
 
 nginxconf=$base_dir/$name/NGINX.conf
-if [[ ! -z "$ppid" ]]; then
+if [ "$hot" = "true" ]; then
+    echo "Left the workers of $name running, they will pick up the new model by themselves." 1>&2
+elif [[ ! -z "$ppid" ]] && ps -o args= -p "$ppid" | grep -q -- "--preload"; then
+    echo "ERROR: API $name has been started with a shared, preloaded model (run.sh -s)." 1>&2
+    echo "Reloading would not pick up a new model. Restart it using stop.sh and run.sh instead." 1>&2
+    echo "Type '$0 -h' for help." 1>&2
+    exit 2
+elif [[ ! -z "$ppid" ]]; then
     kill -HUP $ppid
-    echo "Reloaded process $ppid of $name." 1>&2
+    echo "Reloaded process(es) $ppid of $name." 1>&2
 else
     echo "ERROR: API $name is not running. Nothing to stop." 1>&2
     echo "To start a non-running API, use run.sh." 1>&2
@@ -3,24 +3,42 @@ set -e
 
 logpath="$(cat LOGPATH.txt)"
 scriptdir="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
+source "$scriptdir/registry.sh"
 
 usage() {
-    echo "Usage: $0 -a|-p <port> <api_dir>" 1>&2
+    echo "Usage: $0 -a|-p <port> [-i <instances>] [-s] <api_dir>" 1>&2
     echo "Runs the API <api_dir> locally and adds it to the nginx configuration." 1>&2
     echo "NOTE: You still need to activate the nginx configuration yourself using 'sudo systemctl reload nginx'." 1>&2
-    echo "Options: -p <port>  Listen to local port number <port>" 1>&2
-    echo "         -a         Automatically choose local port" 1>&2
+    echo "      nginx's http block has to include <apis_dir>/*/NGINX_UPSTREAM.conf, and the server block <apis_dir>/*/NGINX.conf." 1>&2
+    echo "Gunicorn's workers, threads etc. are taken from the API's LAUNCHPAD_SERVER.txt (config section deploy:server)." 1>&2
+    echo "Options: -p <port>  Listen to local port number <port> (and the following ports for more instances)," 1>&2
+    echo "                    which must be free" 1>&2
+    echo "         -a         Automatically choose local port(s)" 1>&2
+    echo "         -i <n>     Run <n> Gunicorn instances, load-balanced by nginx. Overrides 'instances' in deploy:server." 1>&2
+    echo "         -s         Share the model: load the app (model and preloaded datasources) once in the" 1>&2
+    echo "                    Gunicorn master and fork the workers from it (gunicorn --preload)." 1>&2
+    echo "                    Saves memory and startup time per worker, but reload.sh cannot pick up" 1>&2
+    echo "                    retrained models anymore (restart using stop.sh/run.sh instead)." 1>&2
+    echo "                    Same as 'preload: True' in deploy:server." 1>&2
     echo "         -h         Show this message and exit." 1>&2
 }
 
-while getopts "ap:h" o; do
+preload=
+instances=
+while getopts "ap:i:sh" o; do
     case $o in
         a)
-            port=$(./findport.sh)
+            port=auto
             ;;
         p)
             port=$OPTARG
             ;;
+        i)
+            instances=$OPTARG
+            ;;
+        s)
+            preload=--preload
+            ;;
         h)
             usage
             exit 0
@@ -45,11 +63,16 @@ if [ ! -d "$1" ]; then
 fi
 
 numre='^[0-9]+$'
-if ! [[ $port =~ $numre ]]; then
+if ! [[ $port =~ $numre || $port == auto ]]; then
     echo "ERROR: <port> must be a free port number" 1>&2
     echo "Type '$0 -h' for help." 1>&2
     exit 2
 fi
+if ! [[ -z "$instances" || $instances =~ $numre ]]; then
+    echo "ERROR: <instances> must be a number" 1>&2
+    echo "Type '$0 -h' for help." 1>&2
+    exit 2
+fi
 
 name=$(basename "$1")
 api_dir=$1
@@ -83,22 +106,86 @@ cd $api_dir
 echo "Activating Python environment for API $name..." 1>&2
 source .venv/bin/activate
 
-echo "Starting Gunicorn daemon..." 1>&2
-gunicorn="$(pwd)/.venv/bin/python3 -m gunicorn.app.wsgiapp"
-$gunicorn "${@:3}" --daemon --log-file $logpath/$name.log --capture-output --workers 4 --bind 127.0.0.1:$port mllaunchpad.wsgi
-#$gunicorn "${@:3}" --daemon --log-file $logpath/$name.log --capture-output --workers 1 --bind 127.0.0.1:$port mllaunchpad.wsgi
+# Server settings from the artifact's LAUNCHPAD_SERVER.txt (from deploy:server in the config, see build.py)
+server_workers=4
+server_threads=1
+server_worker_class=
+server_max_requests=0
+server_max_requests_jitter=0
+server_timeout=30
+server_preload=false
+server_instances=1
+server_micro_cache=0
+if [ -f LAUNCHPAD_SERVER.txt ]; then
+    while IFS="=" read -r key value; do
+        case $key in
+            workers|threads|worker_class|max_requests|max_requests_jitter|timeout|preload|instances|micro_cache)
+                declare server_$key="$value"
+                ;;
+        esac
+    done < LAUNCHPAD_SERVER.txt
+fi
+cores="$(nproc)"
+workers=$(( ${server_workers//cores/$cores} ))
+threads=$(( ${server_threads//cores/$cores} ))
+if [[ "$server_preload" == "true" ]]; then
+    preload=--preload
+fi
+instances=${instances:-$server_instances}
+if [[ -z "$server_worker_class" ]]; then
+    # nginx can only keep connections to the instances alive with non-sync workers
+    server_worker_class=$( (( instances > 1 )) && echo gthread || echo sync )
+fi
+# Sync workers close each connection after one request (gunicorn uses gthread for more threads)
+keepalive=true
+if [[ "$server_worker_class" == "sync" ]] && (( threads == 1 )); then
+    keepalive=false
+    if (( instances > 1 )); then
+        echo "WARNING: nginx can't keep connections to the instances alive with sync workers, consider worker_class: gthread." 1>&2
+    fi
+fi
+if [[ "$port" == "auto" ]]; then
+    ports=($($scriptdir/findport.sh -n $instances))
+else
+    # Fails if any of the ports is in use (or reserved by findport.sh for another API that is starting)
+    ports=($($scriptdir/findport.sh -n $instances -p $port))
+fi
+echo "Using $instances instance(s) with $workers workers with $threads threads each (worker class $server_worker_class) on $cores cores." 1>&2
+
+apipath="$(pwd)"
+url="$(cat LAUNCHPAD_BASE_URL.txt)"
+gunicorn="$apipath/.venv/bin/python3 -m gunicorn.app.wsgiapp"
+rm -f GUNICORN*.pid
+for port in "${ports[@]}"; do
+    echo "Starting Gunicorn daemon on port $port..." 1>&2
+    $gunicorn "${@:3}" -c $scriptdir/gunicorn_conf.py $preload --daemon --pid "$(pwd)/GUNICORN_$port.pid" \
+        --log-file $logpath/$name.log --capture-output \
+        --workers $workers --threads $threads --worker-class $server_worker_class \
+        --max-requests $server_max_requests --max-requests-jitter $server_max_requests_jitter --timeout $server_timeout \
+        --bind 127.0.0.1:$port mllaunchpad.wsgi
+done
 
 deactivate
 
 cd $scriptdir
 
-sleep 3
-waiting=10
-runinfo="$(./status.sh -q $name)"
-ppid="$(cut -d, -f4 <<<"$runinfo")"
-while [[ -z "$ppid" ]]; do
-    runinfo="$(./status.sh -q $name)"
-    ppid="$(cut -d, -f4 <<<"$runinfo")"
+# Gunicorn writes each instance's pid file once it has started
+started() {
+    pids=()
+    for port in "${ports[@]}"; do
+        pids+=($(cat "$apipath/GUNICORN_$port.pid" 2>/dev/null))
+    done
+    (( ${#pids[@]} == instances ))
+}
+# Register the running API's instances for status.sh and stop.sh (see registry.sh)
+register() {
+    for i in "${!ports[@]}"; do
+        echo "$name,${pids[$i]},${ports[$i]},$url,$1"
+    done | registry_replace "$name"
+}
+waiting=65
+until started; do
+    sleep 0.2
     echo -n "."
     let waiting--
     if (( $waiting <= 0 )); then
@@ -106,20 +193,71 @@ while [[ -z "$ppid" ]]; do
         echo "Type '$0 -h' for help." 1>&2
         exit 4
     fi
-    sleep 1
 done
+register starting
 echo "Started." 1>&2
 
+# Workers only accept requests after warming up (deploy:server:warmup_rounds, see gunicorn_conf.py)
+echo -n "Waiting for the API to answer its test query" 1>&2
+test_url="$(cat $base_dir/$name/LAUNCHPAD_TEST_URL.txt)"
+waiting=60
+answering() {
+    for port in "${ports[@]}"; do
+        curl -fs -o /dev/null "http://127.0.0.1:$port$test_url" || return 1
+    done
+}
+until answering; do
+    echo -n "."
+    let waiting--
+    if (( $waiting <= 0 )); then
+        echo "" 1>&2
+        echo "WARNING: API $name does not answer its test query yet. Check $logpath/$name.log." 1>&2
+        register unhealthy
+        break
+    fi
+    sleep 1
+done
+if (( $waiting > 0 )); then
+    register healthy
+    echo " Ready." 1>&2
+fi
+
+# The upstream (in nginx's http context) balances over all instances and, unless the workers are
+# sync workers, keeps idle connections open for reuse.
+upstream="launchpad_${name//[^a-zA-Z0-9_]/_}"
+upstreamconf=$base_dir/$name/NGINX_UPSTREAM.conf
+echo "Creating NGINX upstream configuration fragment for this API in $upstreamconf" 1>&2
+echo "upstream $upstream {">$upstreamconf
+for port in "${ports[@]}"; do
+    echo "    server 127.0.0.1:$port;">>$upstreamconf
+done
+if $keepalive; then
+    echo "    keepalive $((2 * instances * workers));">>$upstreamconf
+fi
+echo "}">>$upstreamconf
+if (( $server_micro_cache > 0 )); then
+    echo "proxy_cache_path /var/cache/nginx/$upstream keys_zone=$upstream:1m max_size=100m inactive=1m;">>$upstreamconf
+fi
+chmod o+r "$upstreamconf"
+
 nginxconf=$base_dir/$name/NGINX.conf
 echo "Creating NGINX configuration fragment for this API in $nginxconf" 1>&2
-url="$(cut -d, -f3 <<<"$runinfo")"
-port="$(cut -d, -f5 <<<"$runinfo")"
 echo "location /$url {">$nginxconf
-echo "    proxy_pass http://127.0.0.1:$port/$url;">>$nginxconf
+echo "    proxy_pass http://$upstream/$url;">>$nginxconf
+echo "    proxy_http_version 1.1;">>$nginxconf
+echo "    proxy_set_header Connection \"\";">>$nginxconf
+if (( $server_micro_cache > 0 )); then
+    # Serve identical GET requests from nginx for a few seconds (deploy:server:micro_cache)
+    echo "    proxy_cache $upstream;">>$nginxconf
+    echo "    proxy_cache_methods GET HEAD;">>$nginxconf
+    echo "    proxy_cache_valid 200 ${server_micro_cache}s;">>$nginxconf
+    echo "    proxy_cache_lock on;">>$nginxconf
+    echo "    proxy_cache_use_stale updating;">>$nginxconf
+fi
 echo "}">>$nginxconf
 chmod o+r "$nginxconf"
 
-echo "Started Gunicorn daemon for API $name on 127.0.0.1:$port." 1>&2
+echo "Started $instances Gunicorn daemon(s) for API $name on 127.0.0.1, port(s) ${ports[*]}." 1>&2
 echo "Logging to $logpath/$name.log. Use status.sh to check for running/stopped APIs." 1>&2
 echo "Use stop.sh <api> to stop APIs." 1>&2
 echo "Run 'sudo systemctl reload nginx' when done starting/stopping APIs to take the changes live." 1>&2
@@ -1,20 +1,26 @@
 #!/usr/bin/bash
 
 scriptdir="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
+source "$scriptdir/registry.sh"
 
 usage() {
-    echo "Usage: $0 [-q] [api_dir]" 1>&2
+    echo "Usage: $0 [-q] [-c] [api_dir]" 1>&2
     echo "Outputs status of all APIs or of API <api_dir> (if specified)." 1>&2
-    echo "The output columns are: api_name, base_url, process, local_port" 1>&2
+    echo "The output columns are: deployed_ok, api_name, base_url, process, local_port, nginx[, health]" 1>&2
     echo "Options: -q    Quiet mode (suppress helpful messages)." 1>&2
+    echo "         -c    Check the health of running APIs by calling their test query (adds a health column)." 1>&2
+    echo "               The instances of an API are checked in parallel, each with a timeout of 1 second." 1>&2
     echo "         -h    Show this message and exit." 1>&2
 }
 
-while getopts ":qh" o; do
+while getopts ":qch" o; do
     case $o in
         q)
             quiet="1"
             ;;
+        c)
+            check="1"
+            ;;
         h)
             usage
             exit 0
@@ -46,18 +52,58 @@ getstatus() {
         innginx=nginx
     fi
     url="$(cat $fullpath/LAUNCHPAD_BASE_URL.txt)"
-    # ps's H option prints hierarchically, with parent processes before child processes
-    # so we can just take the first matching line, which will be the parent process.
-    line="$(ps -efH | grep -v grep | grep -m 1 "$fullpath/\.venv")"
-    port="$(sed -r "s/^.*127.0.0.1:([[:digit:]]+).*$/\1/g" <<<"$line")"
-    ppid="$(sed -r "s/[^ ]+ +([0-9]+).*$/\1/g" <<<"$line")"
-    if [[ ! -z "$line" ]]; then
-        echo "$ok,$name,$url,$ppid,$port,$innginx"
+    # run.sh registers the pid and port of each Gunicorn instance of a running API (see registry.sh).
+    # A registered pid is only trusted if that process still is this API's Gunicorn.
+    # With several instances, the process and port columns contain space-separated lists.
+    ppid=
+    port=
+    registered_ppid=
+    while IFS=, read -r _ instance_pid instance_port _; do
+        if grep -qaF "$fullpath/.venv" /proc/$instance_pid/cmdline 2>/dev/null; then
+            ppid="${ppid:+$ppid }$instance_pid"
+            port="${port:+$port }$instance_port"
+            registered_ppid=$ppid
+        fi
+    done < <(awk -F, -v name="$name" '$1 == name' <<<"$registered")
+    if [[ -z "$ppid" ]]; then
+        # Not registered (e.g. started by an older run.sh): look for the process.
+        # ps's H option prints hierarchically, with parent processes before child processes
+        # so we can just take the first matching line, which will be the parent process.
+        if [[ -z "$processes" ]]; then
+            processes="$(ps -efH | grep -v grep)"
+        fi
+        line="$(grep -m 1 "$fullpath/\.venv" <<<"$processes")"
+        if [[ ! -z "$line" ]]; then
+            port="$(sed -r "s/^.*127.0.0.1:([[:digit:]]+).*$/\1/g" <<<"$line")"
+            ppid="$(sed -r "s/[^ ]+ +([0-9]+).*$/\1/g" <<<"$line")"
+        fi
+    fi
+    health=
+    if [[ ! -z "$check" ]]; then
+        health=",down"
+        if [[ ! -z "$ppid" ]]; then
+            test_url="$(cat $fullpath/LAUNCHPAD_TEST_URL.txt)"
+            checks=()
+            for instance_port in $port; do
+                curl -fs -m 1 -o /dev/null "http://127.0.0.1:$instance_port$test_url" &
+                checks+=($!)
+            done
+            health=",healthy"
+            for check_pid in "${checks[@]}"; do
+                wait $check_pid || health=",unhealthy"
+            done
+            [[ -z "$registered_ppid" ]] || paste -d, <(tr ' ' '\n' <<<"$ppid") <(tr ' ' '\n' <<<"$port") \
+                | awk -F, -v OFS=, -v name="$name" -v url="$url" -v health="${health#,}" '{print name, $1, $2, url, health}' \
+                | registry_replace "$name"
+        fi
+    fi
+    if [[ ! -z "$ppid" ]]; then
+        echo "$ok,$name,$url,$ppid,$port,$innginx$health"
         if [[ -z "$quiet" ]]; then
             echo "API $name ($url) is running as PID $ppid and listening on port $port." 1>&2
         fi
     else
-        echo "$ok,$name,$url,,,$innginx"
+        echo "$ok,$name,$url,,,$innginx$health"
         if [[ -z "$quiet" ]]; then 
             echo "API $name ($url) is NOT running." 1>&2
             if [ "$ok" != "OK" ]; then
@@ -70,9 +116,11 @@ getstatus() {
     cd $origdir
 }
 
+registered="$(registry_read)"
 if [[ -z "$1" ]]; then
     # echo "api_name,base_url,process,local_port" 1>&2
     # Find and print status of all deployed APIs
+    processes="$(ps -efH | grep -v grep)"
     validapis=""
     for dir in $scriptdir/*/; do
         getstatus $dir -q
@@ -86,7 +134,7 @@ if [[ -z "$1" ]]; then
     apispath="$(cd $fullpath/.. && pwd)"
     #ps -ef | grep -v grep | grep -E "$apispath/($validapis)/\.venv" 1>&2
     tput setaf 1
-    ps -ef | grep -v grep | grep "$apispath/.*/\.venv" | grep -vE "$apispath/($validapis)/\.venv" 1>&2
+    grep "$apispath/.*/\.venv" <<<"$processes" | grep -vE "$apispath/($validapis)/\.venv" 1>&2
     if [ $? == 0 ]; then
         echo "" 1>&2
         echo "WARNING: There are rogue APIs running (which listen to a port but don't have a deployed directory)." 1>&2
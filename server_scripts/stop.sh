@@ -2,6 +2,7 @@
 set -e
 
 scriptdir="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
+source "$scriptdir/registry.sh"
 
 usage() {
     echo "Usage: $0 -n|-k <api_dir>" 1>&2
@@ -57,7 +58,7 @@ nginxconf=$base_dir/$name/NGINX.conf
 if [[ "$kill" != "true" ]]; then
     if [ -f "$nginxconf" ]; then
         echo "Removing $name from nginx configuration" 1>&2
-        rm -f $nginxconf
+        rm -f $nginxconf $base_dir/$name/NGINX_UPSTREAM.conf
         echo "Please run/stop other APIs as needed, then 'sudo systemctl reload nginx' to take the configuration live." 1>&2
         echo "After reloading nginx, run 'stop.sh -k $name' to kill $name's process." 1>&2
     else
@@ -70,6 +71,7 @@ elif [ -f "$nginxconf" ]; then
 else
     if [[ ! -z "$ppid" ]]; then
         kill $ppid
+        registry_replace "$name" </dev/null
         echo "Stopped $name's process." 1>&2
     else
         echo "ERROR: API $name is not running. Nothing to stop." 1>&2
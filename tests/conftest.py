@@ -0,0 +1,65 @@
+import os
+
+import pytest
+import yaml
+
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FEATURES = ["sepal.length", "sepal.width", "petal.length", "petal.width"]
+
+
+def iris_frame():
+    from sklearn.datasets import load_iris
+
+    iris = load_iris(as_frame=True)
+    df = iris.data.copy()
+    df.columns = FEATURES
+    df["variety"] = [iris.target_names[t].capitalize() for t in iris.target]
+    return df
+
+
+@pytest.fixture
+def iris_csv(tmp_path):
+    """Paths of the iris training and holdout CSV files (every 5th row is held out)"""
+    df = iris_frame()
+    train, holdout = str(tmp_path / "iris_train.csv"), str(tmp_path / "iris_holdout.csv")
+    df[df.index % 5 != 0].to_csv(train, index=False)
+    df[df.index % 5 == 0].to_csv(holdout, index=False)
+    return train, holdout
+
+
+@pytest.fixture
+def config(tmp_path, iris_csv, monkeypatch):
+    """config_deploy.yml pointing to the iris CSV files and a model store in tmp_path (the working directory)"""
+    pytest.importorskip("mllaunchpad")
+    with open(os.path.join(repo_dir, "config_deploy.yml")) as f:
+        config = yaml.safe_load(f)
+    config["datasources"]["petals"]["path"], config["datasources"]["petals_test"]["path"] = iris_csv
+    config["model_store"]["location"] = str(tmp_path / "model_store")
+    config["api"]["raml"] = os.path.join(repo_dir, "api.raml")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.syspath_prepend(repo_dir)
+    return config
+
+
+def train(config):
+    """Train (and store) the model of `config`, return the model and its wrapper implementing predict"""
+    import mllaunchpad
+
+    mllaunchpad.model_actions.clear_caches()  # mllaunchpad caches datasources and models by model name
+    wrapper, _ = mllaunchpad.train_model(config)
+    return wrapper.contents, wrapper
+
+
+@pytest.fixture
+def client(config):
+    """Flask test client of the API, after training the model"""
+    from flask import Flask
+    from mllaunchpad.api import ModelApi
+
+    from app.encoders import reject_non_object_bodies
+
+    train(config)
+    app = Flask(__name__, root_path=repo_dir)
+    ModelApi(config, app)
+    reject_non_object_bodies(app)  # Like gunicorn_conf.py
+    return app.test_client()
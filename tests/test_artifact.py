@@ -0,0 +1,37 @@
+import os
+from zipfile import ZipFile
+
+import pytest
+
+import build
+
+
+@pytest.fixture(params=[True, False], ids=["raw", "public_api"])
+def raw_writes(request, monkeypatch):
+    if not request.param:
+        monkeypatch.setattr(build, "writes_raw_members", lambda zip_file: False)
+    return request.param
+
+
+def test_package_artifact_round_trip(tmp_path, monkeypatch, raw_writes):
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("app")
+    contents = {"app/model.py": b"print('model')\n" * 1000, "app/data.whl": os.urandom(5000)}
+    for path, data in contents.items():
+        with open(path, "wb") as f:
+            f.write(data)
+    generated = [("LAUNCHPAD_CONFIG.yml", "model: {}\n")]
+
+    build.package_artifact("first.zip", list(contents), generated)
+    with open("app/model.py", "ab") as f:
+        f.write(b"# changed\n")
+    contents["app/model.py"] += b"# changed\n"
+    build.package_artifact("second.zip", list(contents), generated, previous_zip="first.zip")
+
+    with ZipFile("second.zip") as zip_file:
+        assert zip_file.testzip() is None
+        for path, data in contents.items():
+            assert zip_file.read(path) == data
+        assert zip_file.read("LAUNCHPAD_CONFIG.yml") == b"model: {}\n"
+        manifest = zip_file.read(build.manifest_file_name)
+    assert b"app/data.whl" in manifest
@@ -0,0 +1,76 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from app import batching
+
+
+class RecordingModel:
+    """Predicts each row's double, recording the size of every batch"""
+
+    def __init__(self, gate=None):
+        self.batches = []
+        self.gate = gate
+
+    def predict_rows(self, rows):
+        if self.gate is not None:
+            self.gate.wait()
+        self.batches.append(len(rows))
+        return [2 * row for row in rows]
+
+
+def predict_rows(model, rows):
+    return model.predict_rows(rows)
+
+
+def test_concurrent_rows_are_predicted_together():
+    model = RecordingModel()
+    batcher = batching.MicroBatcher(model, predict_rows, max_wait_ms=200, max_rows=8)
+    try:
+        with ThreadPoolExecutor(8) as pool:
+            assert list(pool.map(batcher.predict, range(8))) == [2 * i for i in range(8)]
+    finally:
+        batcher.stop()
+    assert model.batches == [8]
+
+
+def test_batches_are_limited_to_max_rows():
+    gate = threading.Event()
+    model = RecordingModel(gate)
+    batcher = batching.MicroBatcher(model, predict_rows, max_wait_ms=50, max_rows=3)
+    try:
+        with ThreadPoolExecutor(7) as pool:
+            results = pool.map(batcher.predict, range(7))
+            gate.set()
+            assert sorted(results) == [2 * i for i in range(7)]
+    finally:
+        batcher.stop()
+    assert max(model.batches) <= 3 and sum(model.batches) == 7
+
+
+def test_errors_reach_every_caller_of_the_batch():
+    def fail(model, rows):
+        raise ValueError("bad rows")
+
+    batcher = batching.MicroBatcher(None, fail, max_wait_ms=100, max_rows=2)
+    try:
+        with ThreadPoolExecutor(2) as pool:
+            futures = [pool.submit(batcher.predict, i) for i in range(2)]
+            for future in futures:
+                with pytest.raises(ValueError, match="bad rows"):
+                    future.result()
+    finally:
+        batcher.stop()
+
+
+def test_get_batcher_is_replaced_for_another_model(monkeypatch):
+    monkeypatch.setattr(batching, "_batcher", None)
+    model, new_model = RecordingModel(), RecordingModel()
+    batcher = batching.get_batcher(model, predict_rows, max_wait_ms=0)
+    assert batching.get_batcher(model, predict_rows, max_wait_ms=0) is batcher
+    new_batcher = batching.get_batcher(new_model, predict_rows, max_wait_ms=0)
+    assert new_batcher is not batcher and new_batcher.predict(3) == 6
+    batcher._thread.join(1)
+    assert not batcher._thread.is_alive()
+    new_batcher.stop()
@@ -0,0 +1,76 @@
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+import benchmark
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def server():
+    """Local HTTP/1.1 server answering /ok with 200 and anything else with 500, counting connections"""
+    connections = []
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            connections.append(self.client_address)
+
+        def do_GET(self):
+            body = b"{}"
+            self.send_response(200 if self.path.startswith("/ok") else 500)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = Server(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield "http://127.0.0.1:{}".format(httpd.server_address[1]), connections
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_closed_loop_keeps_one_connection_per_client(server):
+    base_url, connections = server
+    run = benchmark.LoadRun(base_url, ["/ok?a=1", "/ok?a=2"], duration=0.3)
+    run.closed_loop(3)
+    assert run.errors == 0 and len(run.latencies) > 10
+    assert len(connections) == 3
+
+
+def test_errors_are_counted(server):
+    base_url, _ = server
+    run = benchmark.LoadRun(base_url, ["/ok", "/fail"], duration=0.2)
+    run.closed_loop(1)
+    assert run.errors > 0 and len(run.latencies) > 0
+    run.open_loop(rate=50)
+    assert run.errors > 1
+
+
+@pytest.mark.parametrize("server_cfg, worker_class", [(None, "sync"), ({"instances": 2}, "gthread"),
+                                                      ({"worker_class": "gevent"}, "gevent")])
+def test_server_command_of_default_worker_class(server_cfg, worker_class):
+    settings = dict(item.split("=", 1) for item in benchmark.server_settings(server_cfg).splitlines())
+    cmd = benchmark.server_command(settings, 8123)
+    assert cmd[cmd.index("--worker-class") + 1] == worker_class
+    assert cmd[cmd.index("--bind") + 1] == "127.0.0.1:8123"
+
+
+def test_server_command_of_shipped_config():
+    config, _ = benchmark.get_config(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                                  "config_deploy.yml"))
+    settings = dict(item.split("=", 1) for item in benchmark.server_settings(config["deploy"]["server"]).splitlines())
+    cmd = benchmark.server_command(settings, 8123)
+    assert "" not in cmd
+    assert cmd[cmd.index("--worker-class") + 1] == "sync"
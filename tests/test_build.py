@@ -0,0 +1,68 @@
+import os
+
+import pytest
+
+import build
+
+
+@pytest.mark.parametrize("formula, cores, expected", [
+    ("4", 8, 4),
+    ("cores", 8, 8),
+    ("2*cores+1", 8, 17),
+    ("(cores + 1) / 2", 4, 2),
+    ("cores-1", 1, 0),
+    ("10 - 2 - 3", 1, 5),
+])
+def test_evaluate_formula(formula, cores, expected):
+    assert build.evaluate_formula(formula, cores) == expected
+
+
+@pytest.mark.parametrize("formula", ["cores/0", "()", "2**", "2*", "cores cores", "1.5", "__import__('os')", ""])
+def test_evaluate_formula_rejects_malformed(formula):
+    with pytest.raises(ValueError):
+        build.evaluate_formula(formula, 4)
+
+
+def test_server_settings():
+    settings = dict(line.split("=", 1) for line in build.server_settings({"workers": "2*cores+1", "preload": True}).split())
+    assert settings["workers"] == "2*cores+1" and settings["preload"] == "true" and settings["threads"] == "1"
+
+
+def test_server_settings_warn_about_sync_workers_of_several_instances(capsys):
+    build.server_settings({"instances": 2, "worker_class": "sync"})
+    assert "WARNING" in capsys.readouterr().out
+    settings = dict(line.split("=", 1) for line in build.server_settings({"instances": 2}).split())
+    assert settings["worker_class"] == "" and capsys.readouterr().out == ""
+
+
+@pytest.mark.parametrize("server_cfg", [{"workers": "cores/0"}, {"threads": "cores-1"}, {"workers": 0},
+                                        {"instances": 0}, {"bogus": 1}])
+def test_server_settings_rejects_invalid(server_cfg):
+    with pytest.raises((AssertionError, ValueError)):
+        build.server_settings(server_cfg)
+
+
+def test_build_environment_installs_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(build, "venv_location", str(tmp_path / ".venv_temp_deploy"))
+    monkeypatch.setattr(build.venv, "create", lambda location, **kwargs: os.makedirs(location))
+    pip_calls = []
+    monkeypatch.setattr(build, "run_pip", lambda interpreter, req_cfg, params: pip_calls.append(params))
+    req_file = tmp_path / "requirements.txt"
+    req_file.write_text("pandas==1.1.5\n")
+
+    with build.BuildEnvironment(str(req_file), keep=True) as unused:
+        pass
+    assert not os.path.exists(unused.location)
+
+    with build.BuildEnvironment(str(req_file), keep=True) as env:
+        env.pip_install_once({}, ["safety"], "error")
+        env.pip_install_once({}, ["safety"], "error")
+    assert pip_calls == [["install", "safety"]] and os.path.isdir(env.location)
+
+    with build.BuildEnvironment(str(req_file), keep=True) as reused:
+        reused.pip_install_once({}, ["safety"], "error")
+    assert reused.location == env.location and len(pip_calls) == 1
+
+    with build.BuildEnvironment() as temporary:
+        temporary.pip_install_once({}, ["safety"], "error")
+    assert len(pip_calls) == 2 and not os.path.exists(temporary.location)
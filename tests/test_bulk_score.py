@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip("mllaunchpad")
+
+from app.bulk_score import FileWriter, bulk_score  # noqa: E402
+from conftest import FEATURES, iris_frame, train  # noqa: E402
+
+
+@pytest.mark.parametrize("extension", ["csv", "jsonl"])
+def test_scores_in_input_order(config, tmp_path, extension):
+    model, _ = train(config)
+    df = iris_frame().drop(columns="variety").rename_axis("id").reset_index()
+    input_path, output_path = str(tmp_path / "input.{}".format(extension)), str(tmp_path / "scored.{}".format(extension))
+    if extension == "csv":
+        df.to_csv(input_path, index=False)
+    else:
+        df.to_json(input_path, orient="records", lines=True)
+
+    rows = bulk_score(input_path, FileWriter(output_path).write, config, chunksize=17, workers=2)
+
+    scored = pd.read_csv(output_path) if extension == "csv" else pd.read_json(output_path, lines=True)
+    assert rows == len(df)
+    assert scored["id"].tolist() == df["id"].tolist()
+    assert scored["iris_variety"].tolist() == model.predict(df[FEATURES].to_numpy()).tolist()
+
+
+def test_missing_model_fails(config, tmp_path):
+    input_path = str(tmp_path / "input.csv")
+    iris_frame().to_csv(input_path, index=False)
+    with pytest.raises(FileNotFoundError):
+        bulk_score(input_path, FileWriter(str(tmp_path / "scored.csv")).write, config, workers=1)
@@ -0,0 +1,60 @@
+import pytest
+
+from app import cache
+from app.features import FeatureSchema
+
+schema = FeatureSchema(["sepal.length", "sepal.width"])
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(cache.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_keys_are_coerced_and_rounded():
+    predictions = cache.PredictionCache(None, "1.0", decimals=2)
+    assert predictions.key(schema, {"sepal.length": "4.9", "sepal.width": 2.4001}) == \
+        predictions.key(schema, {"sepal.length": 4.90, "sepal.width": 2.4})
+
+
+def test_least_recently_used_entries_are_evicted():
+    predictions = cache.PredictionCache(None, "1.0", capacity=2)
+    predictions.put("a", 1)
+    predictions.put("b", 2)
+    assert predictions.get("a") == (True, 1)
+    predictions.put("c", 3)
+    assert predictions.get("b") == (False, None)
+    assert predictions.get("a") == (True, 1) and predictions.get("c") == (True, 3)
+    assert predictions.stats()["evictions"] == 1 and predictions.stats()["size"] == 2
+
+
+def test_entries_expire(clock):
+    predictions = cache.PredictionCache(None, "1.0", ttl=10)
+    predictions.put("a", 1)
+    clock[0] += 10
+    assert predictions.get("a") == (True, 1)
+    clock[0] += 1
+    assert predictions.get("a") == (False, None)
+    stats = predictions.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 0)
+
+
+def test_entries_never_expire_with_ttl_0(clock):
+    predictions = cache.PredictionCache(None, "1.0", ttl=0)
+    predictions.put("a", 1)
+    clock[0] += 1e6
+    assert predictions.get("a") == (True, 1)
+
+
+def test_new_cache_for_another_model_or_version(monkeypatch):
+    monkeypatch.setattr(cache, "_cache", None)
+    assert cache.cache_stats() is None
+    model, new_model = object(), object()
+    predictions = cache.get_cache(model, "1.0")
+    predictions.put("a", 1)
+    assert cache.get_cache(model, "1.0") is predictions
+    assert cache.get_cache(model, "1.1") is not predictions
+    assert cache.get_cache(new_model, "1.1").get("a") == (False, None)
+    assert cache.cache_stats()["version"] == "1.1"
@@ -0,0 +1,96 @@
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import build
+from conftest import iris_frame, train
+
+pytest.importorskip("mllaunchpad")  # imported by app.datasources
+from app.datasources import NpyDataSource, RefreshingCsvDataSource  # noqa: E402
+
+
+@pytest.fixture
+def npy_dir(tmp_path):
+    directory = str(tmp_path / "iris_npy")
+    build.write_npy_columns(iris_frame(), directory)
+    return directory
+
+
+def test_npy_dataframe(npy_dir):
+    ds = NpyDataSource("petals", {"type": "npy", "path": npy_dir, "expires": 0, "cache_expires": 60})
+    df = ds.get_dataframe()
+    assert df.equals(iris_frame())
+    raw = ds.get_raw()
+    assert isinstance(raw["petal.width"], np.memmap)
+    if int(pd.__version__.split(".")[0]) >= 2:
+        assert np.shares_memory(df["petal.width"].to_numpy(), raw["petal.width"])
+
+
+def test_npy_chunks(npy_dir):
+    ds = NpyDataSource("petals", {"type": "npy", "path": npy_dir, "expires": 0, "cache_expires": 60})
+    chunks = list(ds.get_dataframe(chunksize=40))
+    assert [len(c) for c in chunks] == [40, 40, 40, 30]
+    assert chunks[-1]["variety"].tolist() == iris_frame()["variety"][-30:].tolist()
+
+
+def test_npy_cache_expires(npy_dir, monkeypatch):
+    ds = NpyDataSource("petals", {"type": "npy", "path": npy_dir, "expires": 0, "cache_expires": 60})
+    loads = []
+    load = ds.load
+    monkeypatch.setattr(ds, "load", lambda: loads.append(1) or load())
+    ds.get_dataframe()
+    ds.get_raw()
+    assert len(loads) == 1
+
+
+def test_mllaunchpad_caching_is_rejected(npy_dir):
+    with pytest.raises(ValueError, match="cache_expires"):
+        NpyDataSource("petals", {"type": "npy", "path": npy_dir, "expires": 3600})
+
+
+def test_training_on_npy_datasource(config, npy_dir):
+    config["plugins"] = ["app.datasources"]
+    config["datasources"]["petals"] = {"type": "npy", "path": npy_dir, "expires": 0, "cache_expires": 3600,
+                                       "tags": "train"}
+    config["model"]["train_options"]["chunksize"] = {"petals": 40}
+    model, _ = train(config)
+    assert model.predict(iris_frame().iloc[:5, :4].to_numpy()).tolist() == ["Setosa"] * 5
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.02)
+    return True
+
+
+def test_refreshing_csv_sees_new_data(iris_csv):
+    path = iris_csv[1]
+    ds = RefreshingCsvDataSource("petals_test", {"type": "refreshing_csv", "path": path, "expires": 0,
+                                                 "cache_expires": 2, "refresh_ahead": 1.8})
+    old = ds.get_dataframe()
+    assert ds.get_dataframe() is old  # cached
+    iris_frame()[:3].to_csv(path, index=False)
+    # Reloaded in the background after 0.2 seconds, long before an inline reload (after 2 * cache_expires)
+    assert wait_for(lambda: len(ds.get_dataframe()) == 3, timeout=1.5)
+
+
+def test_refreshing_csv_reloads_expired_data(iris_csv):
+    path = iris_csv[1]
+    ds = RefreshingCsvDataSource("petals_test", {"type": "refreshing_csv", "path": path, "expires": 0,
+                                                 "cache_expires": 0.2})
+    assert len(ds.get_dataframe()) == 30
+    iris_frame()[:3].to_csv(path, index=False)
+    assert len(ds.get_dataframe()) == 30
+    time.sleep(0.25)
+    assert len(ds.get_dataframe()) == 3
+
+
+def test_refreshing_csv_requires_expires_0(iris_csv):
+    with pytest.raises(ValueError, match="expires must be 0"):
+        RefreshingCsvDataSource("petals_test", {"type": "refreshing_csv", "path": iris_csv[1], "expires": 3600,
+                                                "refresh_ahead": 60})
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+flask = pytest.importorskip("flask")
+
+from app import encoders  # noqa: E402
+
+values = np.array(["Versicolor", "Virginica"], dtype=object)
+payload = {"predictions": [{"iris_variety": "Versicolor"}, {"iris_variety": "Virginica"}]}
+
+
+def encode(accept):
+    with flask.Flask(__name__).test_request_context("/", method="POST", headers={"Accept": accept}):
+        return encoders.encode_predictions("iris_variety", values)
+
+
+def test_plain_dict_outside_of_requests():
+    assert encoders.encode_predictions("iris_variety", values) == payload
+
+
+def test_json_by_default():
+    response = encode("*/*")
+    if encoders.orjson is None:
+        assert response == payload
+    else:
+        assert response.mimetype == encoders.JSON and response.get_json() == payload
+
+
+def test_msgpack():
+    msgpack = pytest.importorskip("msgpack")
+    response = encode(encoders.MSGPACK)
+    assert response.mimetype == encoders.MSGPACK
+    assert msgpack.unpackb(response.get_data(), raw=False) == payload
+
+
+def test_arrow():
+    pa = pytest.importorskip("pyarrow")
+    response = encode(encoders.ARROW + ", application/json;q=0.5")
+    assert response.mimetype == encoders.ARROW
+    assert pa.ipc.open_stream(response.get_data()).read_all().to_pydict() == {"iris_variety": list(values)}
+
+
+def test_unsupported_accept_falls_back_to_json(monkeypatch):
+    monkeypatch.setattr(encoders, "SUPPORTED", [encoders.JSON])
+    monkeypatch.setattr(encoders, "orjson", None)
+    assert encode(encoders.MSGPACK) == payload
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from app.features import FeatureSchema
+
+names = ["sepal.length", "sepal.width", "petal.length", "petal.width"]
+row = {"sepal.length": 4.9, "sepal.width": 2.4, "petal.length": 3.3, "petal.width": 1}
+
+
+def test_matrix_of_columns_and_of_rows():
+    schema = FeatureSchema(names)
+    columns = {name: [row[name], row[name] + 1] for name in names}
+    rows = [row, {name: value + 1 for name, value in row.items()}]
+    expected = np.array([[4.9, 2.4, 3.3, 1], [5.9, 3.4, 4.3, 2]])
+    assert np.array_equal(schema.matrix(columns), expected)
+    assert np.array_equal(schema.matrix(rows), expected)
+
+
+def test_unwrap_single_values():
+    schema = FeatureSchema(names)
+    assert schema.unwrap(dict({name: [value] for name, value in row.items()}, other="x")) == dict(row, other="x")
+    assert schema.unwrap(dict(row, **{"petal.width": None})) == dict(row, **{"petal.width": None})
+    batch = {name: [value, value] for name, value in row.items()}
+    assert schema.unwrap(batch) is batch
+    assert schema.is_batch(batch) and not schema.is_batch(schema.unwrap({n: [v] for n, v in row.items()}))
+
+
+def test_invalid_values_name_the_feature():
+    schema = FeatureSchema(names)
+    with pytest.raises(ValueError, match="petal.width"):
+        schema.row(dict(row, **{"petal.width": "wide"}))
+    with pytest.raises(ValueError, match="sepal.width"):
+        schema.matrix(dict({name: [value, value] for name, value in row.items()}, **{"sepal.width": [1, None]}))
+    with pytest.raises(ValueError, match="same length"):
+        schema.matrix(dict({name: [value, value] for name, value in row.items()}, **{"sepal.width": [1]}))
@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from conftest import train
+
+pytest.importorskip("mllaunchpad")  # imported by app.hot_reload
+from app import hot_reload  # noqa: E402
+from app.hot_reload import ModelWatcher  # noqa: E402
+
+single = {"sepal.length": 6.3, "sepal.width": 3.3, "petal.length": 6.0, "petal.width": 2.5}
+
+
+def test_retrained_model_is_swapped_in(config, tmp_path):
+    (tmp_path / "LAUNCHPAD_TEST_URL.txt").write_text("/iris/v0/varieties?sepal.length=4.9&sepal.width=2.4"
+                                                     "&petal.length=3.3&petal.width=1\n")
+    model, wrapper = train(config)
+    warmed = []
+    watcher = ModelWatcher(model, config, lambda new_model, args: warmed.append((new_model, args)),
+                           poll_seconds=0.05)
+
+    config["model"]["train_options"]["compile_tree"] = True
+    train(config)
+    deadline = time.monotonic() + 5
+    while watcher.model is model and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    new_model = watcher.model
+    assert type(new_model).__name__ == "CompiledTree"
+    assert warmed == [(new_model, {"sepal.length": "4.9", "sepal.width": "2.4",
+                                   "petal.length": "3.3", "petal.width": "1"})]
+    assert wrapper.predict(config["model"], {}, {}, new_model, single) == {"iris_variety": "Virginica"}
+
+
+def test_model_failing_to_warm_up_is_not_swapped_in(config, monkeypatch):
+    model, _ = train(config)
+
+    def fail(new_model, args):
+        raise RuntimeError("warm-up failed")
+
+    monkeypatch.setattr(hot_reload, "test_query_args", lambda: {})
+    watcher = ModelWatcher(model, config, fail, poll_seconds=60)
+    with pytest.raises(RuntimeError):
+        watcher.reload()
+    assert watcher.model is model
@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+
+from app import log_handlers
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(log_handlers.time, "monotonic", lambda: now[0])
+    return now
+
+
+def record(msg, level=logging.INFO, name="app.model"):
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+
+def test_rate_limit_per_message(clock):
+    rate_limit = log_handlers.RateLimitFilter(rate=3)
+    assert [rate_limit.filter(record("a")) for _ in range(5)] == [True] * 3 + [False] * 2
+    assert rate_limit.filter(record("b"))
+    assert rate_limit.filter(record("a", level=logging.WARNING))
+    clock[0] += 0.5
+    assert [rate_limit.filter(record("a")) for _ in range(2)] == [True, False]
+
+
+def test_idle_messages_are_forgotten(clock):
+    rate_limit = log_handlers.RateLimitFilter(rate=3)
+    for i in range(100):
+        rate_limit.filter(record("message %d" % i))
+    clock[0] += 1
+    rate_limit.filter(record("a"))
+    assert list(rate_limit._buckets) == [("app.model", "a")]
+
+
+def test_number_of_messages_is_bounded(clock):
+    rate_limit = log_handlers.RateLimitFilter(rate=3, max_messages=10)
+    for i in range(100):
+        rate_limit.filter(record("message %d" % i))
+    assert len(rate_limit._buckets) == 10
+    assert ("app.model", "message 99") in rate_limit._buckets
+
+
+def test_async_handler_writes_in_background():
+    records = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            records.append(record.getMessage())
+
+    handler = log_handlers.AsyncHandler([ListHandler()])
+    handler.handle(record("hello %s" % "world"))
+    handler.close()
+    assert records == ["hello world"]
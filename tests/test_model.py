@@ -0,0 +1,105 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+
+from app.tree_engine import CompiledTree
+from conftest import train
+
+test_query = "sepal.length=4.9&sepal.width=2.4&petal.length=3.3&petal.width=1"
+batch = {"sepal.length": [4.9, 6.3], "sepal.width": [2.4, 3.3], "petal.length": [3.3, 6.0], "petal.width": [1, 2.5]}
+url = "/iris/v0/varieties"
+
+
+def test_single_row(client):
+    response = client.get(url + "?" + test_query)
+    assert response.status_code == 200
+    assert response.get_json() == {"iris_variety": "Versicolor"}
+
+
+def test_batch_of_repeated_query_parameters(client):
+    response = client.get(url + "?" + test_query + "&sepal.length=6.3&sepal.width=3.3&petal.length=6.0&petal.width=2.5")
+    assert response.status_code == 200
+    assert response.get_json() == {"predictions": [{"iris_variety": "Versicolor"}, {"iris_variety": "Virginica"}]}
+
+
+def test_batch_post(client):
+    response = client.post(url, json=batch)
+    assert response.status_code == 200
+    assert response.get_json() == {"predictions": [{"iris_variety": "Versicolor"}, {"iris_variety": "Virginica"}]}
+
+
+def test_batch_post_as_msgpack(client):
+    msgpack = pytest.importorskip("msgpack")
+    response = client.post(url, json=batch, headers={"Accept": "application/msgpack"})
+    assert response.status_code == 200
+    assert msgpack.unpackb(response.get_data(), raw=False) == {
+        "predictions": [{"iris_variety": "Versicolor"}, {"iris_variety": "Virginica"}]}
+
+
+def test_post_of_one_row_is_answered_as_batch(client):
+    response = client.post(url, json={name: values[:1] for name, values in batch.items()})
+    assert response.get_json() == {"predictions": [{"iris_variety": "Versicolor"}]}
+
+
+def test_batch_columns_of_different_lengths_are_rejected(client):
+    response = client.post(url, json=dict(batch, **{"petal.width": [1]}))
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("query", [
+    "sepal.length=4.9&sepal.width=2.4&petal.length=3.3",  # missing feature
+    test_query.replace("=1", "=one"),
+    test_query.replace("=1", "=inf"),
+    test_query + "&sepal.length=6.3&sepal.width=3.3&petal.length=6.0",  # batch columns of different lengths
+])
+def test_invalid_query_is_a_bad_request(client, query):
+    response = client.get(url + "?" + query)
+    assert response.status_code == 400
+
+
+def test_invalid_batch_body_is_a_bad_request(client):
+    response = client.post(url, json=dict(batch, **{"petal.width": [1, "wide"]}))
+    assert response.status_code == 400
+    assert "petal.width" in response.get_json()["message"]
+
+
+def test_array_body_is_not_predicted(client):
+    rows = [{name: values[i] for name, values in batch.items()} for i in range(2)]
+    response = client.post(url, json=rows)
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("predict_options", [{}, {"micro_batch": {"enabled": True}}, {"cache": {"enabled": True}}])
+def test_predictions_do_not_warn(config, predict_options):
+    config["model"]["predict_options"] = predict_options
+    model, wrapper = train(config)
+    single = {name: values[0] for name, values in batch.items()}
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        assert wrapper.predict(config["model"], {}, {}, model, single) == {"iris_variety": "Versicolor"}
+        assert wrapper.predict(config["model"], {}, {}, model, batch) == {
+            "predictions": [{"iris_variety": "Versicolor"}, {"iris_variety": "Virginica"}]}
+
+
+def test_compiled_tree(config):
+    config["model"]["train_options"]["compile_tree"] = True
+    model, wrapper = train(config)
+    assert isinstance(model, CompiledTree)
+    single = {name: values[1] for name, values in batch.items()}
+    assert wrapper.predict(config["model"], {}, {}, model, single) == {"iris_variety": "Virginica"}
+
+
+def test_compiled_tree_arrays_in_model_store(config):
+    from mllaunchpad.resource import ModelStore
+
+    config["model"]["train_options"].update(compile_tree=True, tree_arrays=config["model_store"]["location"])
+    train(config)
+    stored, _ = ModelStore(config).load_trained_model(config["model"])
+    train(config)
+    single = {name: values[1] for name, values in batch.items()}
+    assert stored.predict(config["model"], {}, {}, stored.contents, single) == {"iris_variety": "Virginica"}
+    assert isinstance(stored.contents.children, np.memmap)
+    backups = os.listdir(os.path.join(config["model_store"]["location"], "previous"))
+    assert backups and not [name for name in backups if name.endswith((".npy", ".sha256"))]
@@ -0,0 +1,35 @@
+import pytest
+from sklearn.tree import DecisionTreeClassifier
+
+from conftest import iris_frame
+
+pytest.importorskip("mllaunchpad")  # imported by app.model
+from app.model import search_hyperparameters, warm_start_grid  # noqa: E402
+
+param_grid = {"max_depth": [2, 3, 4, 5, 6], "criterion": ["gini", "entropy"], "min_samples_leaf": [1, 5]}
+
+
+def test_warm_start_grid():
+    grid = warm_start_grid(param_grid, {"max_depth": 4, "criterion": "gini", "splitter": "best"})
+    assert grid == {"max_depth": [3, 4, 5], "criterion": ["gini", "entropy"], "min_samples_leaf": [1, 5]}
+    assert warm_start_grid(param_grid, {"max_depth": 10})["max_depth"] == [6, 10]
+
+
+def search(old_model):
+    df = iris_frame()
+    options = {"param_grid": param_grid, "cv": 3, "n_jobs": 1}
+    return search_hyperparameters(df.iloc[:, :4].to_numpy(), df["variety"].to_numpy(), options, old_model)
+
+
+def test_search_warm_starts_from_previous_search():
+    old_model = DecisionTreeClassifier()
+    old_model.search_params_ = {"max_depth": 3, "criterion": "gini", "min_samples_leaf": 1}
+    _, candidates = search(old_model)
+    assert len(candidates) == 3 * 2 * 2  # max_depth 2, 3 and 4
+
+
+@pytest.mark.parametrize("old_model", [None, DecisionTreeClassifier(max_depth=2)])
+def test_search_uses_full_grid_without_previous_search(old_model):
+    best, candidates = search(old_model)
+    assert len(candidates) == 5 * 2 * 2
+    assert isinstance(best, DecisionTreeClassifier)
@@ -0,0 +1,42 @@
+import pytest
+
+from app import timing
+from conftest import train
+
+
+@pytest.fixture(autouse=True)
+def reset_timing():
+    yield
+    timing.configure(False)
+    with timing._lock:
+        timing._histograms.clear()
+
+
+def test_percentiles_are_bucket_upper_bounds():
+    histogram = timing.Histogram()
+    for ms in [0.3] * 90 + [3] * 9 + [20000]:
+        histogram.add(ms)
+    summary = histogram.summary()
+    assert summary["p50_le_ms"] == 0.5 and summary["p95_le_ms"] == 5 and summary["p99_le_ms"] == 5
+    assert summary["max_ms"] == 20000 and summary["count"] == 100
+    assert histogram.percentile(100) == 20000  # Beyond the last bucket: the maximum
+
+
+def test_disabled_timing_records_nothing():
+    with timing.timed("stage"):
+        pass
+    assert timing.timing_stats() == {}
+    timing.configure(True)
+    with timing.timed("stage"):
+        pass
+    assert timing.timing_stats()["stage"]["count"] == 1
+
+
+def test_first_prediction_is_timed(config):
+    pytest.importorskip("mllaunchpad")
+    config["model"]["predict_options"] = {"timing": {"enabled": True}}
+    model, wrapper = train(config)
+    single = {"sepal.length": 4.9, "sepal.width": 2.4, "petal.length": 3.3, "petal.width": 1}
+    wrapper.predict(config["model"], {}, {}, model, single)
+    stats = timing.timing_stats()
+    assert stats["predict"]["count"] == 1 and stats["predict.inference"]["count"] == 1
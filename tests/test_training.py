@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from conftest import iris_frame, train
+
+pytest.importorskip("mllaunchpad")  # imported by app.model
+from app.model import evaluate_in_chunks, load_training_data  # noqa: E402
+
+
+class FakeDataSource:
+    expires = 0
+
+    def __init__(self, df):
+        self.df = df
+
+    def get_dataframe(self, params=None, chunksize=None):
+        if chunksize:
+            return (self.df[start:start + chunksize] for start in range(0, len(self.df), chunksize))
+        return self.df
+
+
+def test_load_training_data_in_chunks():
+    df = iris_frame()
+    X, y, columns = load_training_data(FakeDataSource(df), chunksize=7)
+    assert columns == list(df.columns[:4])
+    assert X.dtype == np.float32 and np.array_equal(X, df[columns].to_numpy(dtype=np.float32))
+    assert list(y) == list(df["variety"])
+
+
+def test_load_training_data_sample():
+    df = iris_frame()
+    X, y, _ = load_training_data(FakeDataSource(df), chunksize=7, max_rows=50)
+    assert X.shape == (50, 4) and len(y) == 50
+    rows = {tuple(row) for row in df.iloc[:, :4].to_numpy(dtype=np.float32).tolist()}
+    assert all(tuple(row) in rows for row in X.tolist())
+
+
+def test_evaluate_in_chunks_matches_sklearn():
+    from sklearn.metrics import accuracy_score, confusion_matrix
+    from sklearn.tree import DecisionTreeClassifier
+
+    df = iris_frame()
+    model = DecisionTreeClassifier(max_depth=2, random_state=0).fit(df.iloc[:, :4].to_numpy(), df["variety"])
+    acc, conf = evaluate_in_chunks(model, FakeDataSource(df), chunksize=11)
+    y_pred = model.predict(df.iloc[:, :4].to_numpy())
+    assert acc == pytest.approx(accuracy_score(df["variety"], y_pred))
+    assert conf == confusion_matrix(df["variety"], y_pred).tolist()
+
+
+def test_chunked_training(config):
+    config["model"]["train_options"]["chunksize"] = {"petals": 17}
+    model, _ = train(config)
+    assert model.predict(iris_frame().iloc[:5, :4].to_numpy()).tolist() == ["Setosa"] * 5
+
+
+def test_chunked_cached_datasource_is_rejected(config):
+    config["datasources"]["petals"]["expires"] = 3600
+    config["model"]["train_options"]["chunksize"] = {"petals": 17}
+    with pytest.raises(ValueError, match="expires: 0"):
+        train(config)
@@ -0,0 +1,103 @@
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import pytest
+from sklearn.datasets import make_classification
+from sklearn.tree import DecisionTreeClassifier
+
+from app.tree_engine import BLOCK_ROWS, CompiledTree
+from conftest import FEATURES, iris_frame
+
+
+@pytest.fixture(scope="module")
+def iris_tree():
+    df = iris_frame()
+    return DecisionTreeClassifier(random_state=0).fit(df[FEATURES].to_numpy(), df["variety"].to_numpy())
+
+
+@pytest.fixture(scope="module")
+def deep_tree():
+    X, y = make_classification(5000, 10, n_informative=6, n_classes=3, random_state=0)
+    return DecisionTreeClassifier(random_state=0).fit(X, y)
+
+
+def noisy_rows(tree, n_rows, seed=0):
+    rng = np.random.RandomState(seed)
+    return rng.normal(0, 3, (n_rows, tree.n_features_in_))
+
+
+@pytest.mark.parametrize("tree", ["iris_tree", "deep_tree"])
+def test_predictions_are_identical(tree, request):
+    tree = request.getfixturevalue(tree)
+    compiled = CompiledTree.from_sklearn(tree)
+    X = noisy_rows(tree, 2 * BLOCK_ROWS + 10)
+    assert np.array_equal(compiled.predict(X), tree.predict(X))
+    for row in X[:200]:
+        assert compiled.predict(row[np.newaxis]) == tree.predict(row[np.newaxis])
+
+
+def test_thresholds_compare_as_float32(iris_tree):
+    compiled = CompiledTree.from_sklearn(iris_tree)
+    split = np.flatnonzero(iris_tree.tree_.children_left != -1)
+    X = np.zeros((len(split), 4))
+    X[np.arange(len(split)), iris_tree.tree_.feature[split]] = iris_tree.tree_.threshold[split]
+    assert np.array_equal(compiled.predict(X), iris_tree.predict(X))
+
+
+def test_pickle_is_smaller(deep_tree):
+    compiled = CompiledTree.from_sklearn(deep_tree)
+    assert len(pickle.dumps(compiled)) < len(pickle.dumps(deep_tree)) / 2
+    X = noisy_rows(deep_tree, 100)
+    assert np.array_equal(pickle.loads(pickle.dumps(compiled)).predict(X), deep_tree.predict(X))
+
+
+def test_rejects_multi_output_trees():
+    X, y = make_classification(100, 4, random_state=0)
+    tree = DecisionTreeClassifier().fit(X, np.stack([y, y], axis=1))
+    with pytest.raises(ValueError, match="single-output"):
+        CompiledTree.from_sklearn(tree)
+
+
+def saved_files(tree):
+    return set(tree._array_files.values()) | {tree._array_manifest}
+
+
+def test_saved_arrays_are_memory_mapped(deep_tree, tmp_path):
+    compiled = CompiledTree.from_sklearn(deep_tree)
+    compiled.save_arrays(str(tmp_path), "model_tree")
+    loaded = pickle.loads(pickle.dumps(compiled))
+    X = noisy_rows(deep_tree, 100)
+    for row in X[:20]:
+        assert loaded.predict(row[np.newaxis]) == deep_tree.predict(row[np.newaxis])
+    assert isinstance(loaded.children, np.memmap)
+    assert np.array_equal(loaded.predict(X), deep_tree.predict(X))
+
+
+def test_manifest_lists_checksums(iris_tree, tmp_path):
+    compiled = CompiledTree.from_sklearn(iris_tree)
+    compiled.save_arrays(str(tmp_path), "model_tree")
+    assert set(os.listdir(str(tmp_path))) == saved_files(compiled)
+    with open(str(tmp_path / compiled._array_manifest)) as f:
+        for line in f:
+            sha256, name = line.split()
+            assert hashlib.sha256((tmp_path / name).read_bytes()).hexdigest() == sha256
+
+
+def test_saving_keeps_the_arrays_of_the_stored_tree(iris_tree, deep_tree, tmp_path):
+    directory = str(tmp_path)
+    stored = CompiledTree.from_sklearn(iris_tree)
+    stored.save_arrays(directory, "model_tree")
+    stored = pickle.loads(pickle.dumps(stored))
+    untested = CompiledTree.from_sklearn(deep_tree)
+    untested.save_arrays(directory, "model_tree", keep=stored)
+    assert set(os.listdir(directory)) == saved_files(stored) | saved_files(untested)
+
+    df = iris_frame()
+    retrained = CompiledTree.from_sklearn(
+        DecisionTreeClassifier(max_depth=2).fit(df[FEATURES].to_numpy(), df["variety"].to_numpy()))
+    retrained.save_arrays(directory, "model_tree", keep=stored)
+    assert set(os.listdir(directory)) == saved_files(stored) | saved_files(retrained)
+    X = df[FEATURES].to_numpy()
+    assert np.array_equal(stored.predict(X), iris_tree.predict(X))